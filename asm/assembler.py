@@ -1,67 +1,17 @@
 """
-Core assembly logic: label resolution and binary generation.
+Core assembly logic: single-pass binary generation with label backpatching.
 """
 
 from lark import Token
 from instructions import (
     REGISTERS, 
     OPCODES,
+    ADDRESSING_MODE_TO_SIZE,
     validate_instruction_semantics, 
-    get_instruction_size, 
     get_addressing_mode, 
     get_operands
 )
 
-def resolve_labels(tree, logger):
-    """
-    Pass 1: Resolve all labels and calculate their addresses.
-    Returns a dictionary mapping label names to addresses.
-    """
-    logger.debug("Resolving labels...")
-    labels = {}
-    pc = 0
-
-    for node in tree.children:
-        # Skip comments
-        if isinstance(node, Token) and node.type == 'COMMENT':
-            continue
-
-        if not hasattr(node, "data"):
-            logger.error(f"Node has no data: {node}. Perhaps you have an empty start label?")
-            exit(1)
-
-        if node.data == "label":
-            label_name = node.children[0].value
-
-            if labels.get(label_name):
-                logger.error(f"Label {label_name} already defined. Exiting...")
-                exit(1)
-
-            labels[label_name] = pc
-            logger.debug(f"Found label: {label_name} (at {pc})")
-            continue
-
-        if node.data == "instr":
-            validate_instruction_semantics(node, logger)
-            mnemonic = node.children[0].value.upper()
-            operands = get_operands(node)
-
-
-            # get instruction size
-            size = get_instruction_size(mnemonic, operands, logger)
-            if size is None:
-                logger.error(f"Bad instruction: {mnemonic} on line {node.children[0].line}")
-                exit(1)
-            pc += size
-            logger.verbose(f"    Finished processing instruction {mnemonic} at PC={pc-size}, size={size} bytes")
-
-    logger.debug(f"Finished resolving {len(labels)} labels:")
-    for label, address in labels.items():
-        logger.debug(f"    {label} = {address}")
-
-    return labels
-
-
 def get_operand_value(operand, labels, logger):
 
     def get_number_value(value):
@@ -258,52 +208,182 @@ def generate_instruction_binary(opcode, operands, addressing_mode, line, logger)
 
     return binary
 
-def encode_instruction(node, labels, pc, logger):
-    # encode the instruction into a binary
-    mnemonic = node.children[0].value.upper()
-    line = node.children[0].line
-    opcode = OPCODES[mnemonic]
-    tree_operands = get_operands(node)
-    addressing_mode = get_addressing_mode(mnemonic, tree_operands)
-    expected_size = get_instruction_size(mnemonic, tree_operands, logger)
-    
-    logger.verbose(f"Generating binary for instruction {mnemonic} (line {line})...")
+class CodeGenerator:
+    """
+    Single-pass code generation with backpatching.
+    Instructions are encoded as they arrive. An operand naming a label that
+    is not defined yet is encoded as 0 and recorded as a fixup. finish()
+    re-encodes those instructions once every label is known.
+    """
 
-    operands = []
+    def __init__(self, logger):
+        self.logger = logger
+        self.labels = {}
+        self.binary = bytearray()
+        # address of the next instruction
+        self.pc = 0
+        # (offset, opcode, addressing mode, operand tokens, line) per forward reference
+        self.fixups = []
 
-    for operand in tree_operands:
-        operands.append(get_operand_value(operand, labels, logger))
+    def emit(self, data):
+        self.binary.extend(data)
 
+    def patch(self, pc, data):
+        self.binary[pc:pc + len(data)] = data
 
-    logger.verbose(f"    Got opcode={opcode}, operands={operands}, addressing_mode={addressing_mode}")
-    binary_instruction = generate_instruction_binary(opcode, operands, addressing_mode, line, logger)
+    def feed(self, node, line=None):
+        # one top-level node of the parse tree. line overrides the source line
+        # recorded in the tokens (for trees parsed from part of the source)
+        if isinstance(node, Token) and node.type == 'COMMENT':
+            return
 
-    logger.debug(f"Binary: | PC 0x{pc:04X} | {mnemonic:<5} | "
-                 f"{get_bytearray_bits_string(binary_instruction):<36}| {binary_instruction.hex()}")
+        if not hasattr(node, "data"):
+            self.logger.error(f"Node has no data: {node}. Perhaps you have an empty start label?")
+            exit(1)
 
-    if len(binary_instruction) != expected_size:
-        logger.error(
-            f"Instruction {node.children[0].value.upper()} (line {line}) "
-            f"not encoded correctly (expected size {expected_size}, got {len(binary_instruction)})")
-        exit(1)
+        if node.data == "label":
+            self.label(node.children[0].value)
+        elif node.data == "instr":
+            self.instruction(node, line)
 
-    return binary_instruction
+    def label(self, label_name):
+        if label_name in self.labels:
+            self.logger.error(f"Label {label_name} already defined. Exiting...")
+            exit(1)
+        self.labels[label_name] = self.pc
+        self.logger.debug(f"Found label: {label_name} (at {self.pc})")
+
+    def instruction(self, node, line=None):
+        logger = self.logger
+        if line is None:
+            line = node.children[0].line
+        validate_instruction_semantics(node, logger, line)
+        mnemonic = node.children[0].value.upper()
+        opcode = OPCODES[mnemonic]
+        tree_operands = get_operands(node)
+        addressing_mode = get_addressing_mode(mnemonic, tree_operands)
+        if addressing_mode is None:
+            logger.error(f"Bad instruction: {mnemonic} on line {line}")
+            exit(1)
 
+        # the per-instruction log lines are built only when they will be shown
+        verbose = logger.level >= logger.Level.VERBOSE
+        if verbose:
+            logger.verbose(f"Generating binary for instruction {mnemonic} (line {line})...")
+
+        operands = []
+        forward = False
+        for operand in tree_operands:
+            if operand.type == "LABELNAME" and operand.value.strip() not in self.labels:
+                # patched in finish()
+                operands.append(0)
+                forward = True
+            else:
+                operands.append(get_operand_value(operand, self.labels, logger))
+
+        pc = self.pc
+        if forward:
+            self.fixups.append((pc, opcode, addressing_mode, tree_operands, line))
+
+        if verbose:
+            logger.verbose(f"    Got opcode={opcode}, operands={operands}, addressing_mode={addressing_mode}")
+        binary_instruction = generate_instruction_binary(opcode, operands, addressing_mode, line, logger)
+
+        if logger.level >= logger.Level.DEBUG:
+            logger.debug(f"Binary: | PC 0x{pc:04X} | {mnemonic:<5} | "
+                         f"{get_bytearray_bits_string(binary_instruction):<36}| {binary_instruction.hex()}")
+
+        expected_size = ADDRESSING_MODE_TO_SIZE[addressing_mode]
+        if len(binary_instruction) != expected_size:
+            logger.error(
+                f"Instruction {mnemonic} (line {line}) "
+                f"not encoded correctly (expected size {expected_size}, got {len(binary_instruction)})")
+            exit(1)
 
-def generate_binary(tree, labels, logger):
+        self.emit(binary_instruction)
+        self.pc += expected_size
 
+    def resolve_fixups(self):
+        logger = self.logger
+        logger.debug(f"Patching {len(self.fixups)} forward label references...")
+        for pc, opcode, addressing_mode, tree_operands, line in self.fixups:
+            operands = [get_operand_value(operand, self.labels, logger) for operand in tree_operands]
+            binary_instruction = generate_instruction_binary(opcode, operands, addressing_mode, line, logger)
+            self.patch(pc, binary_instruction)
+        self.fixups.clear()
 
-    logger.debug(f"Starting code generation for {len(tree.children)} instructions...")
-    binary = bytearray()
+    def finish(self):
+        # resolve forward references; returns the binary
+        self.resolve_fixups()
+        return self.binary
 
-    for node in tree.children:
-        if isinstance(node, Token) and node.type == 'COMMENT':
-            continue
 
-        if node.data == "label":
-            continue
+class StreamingCodeGenerator(CodeGenerator):
+    """
+    Code generation straight into a seekable binary file.
+    Encoded instructions are written as they arrive and fixups are patched
+    in place, so memory use depends on the labels and forward references,
+    not on the size of the program.
+    """
+
+    def __init__(self, logger, out):
+        super().__init__(logger)
+        self.binary = None
+        self.out = out
+
+    def emit(self, data):
+        self.out.write(data)
+
+    def patch(self, pc, data):
+        self.out.seek(pc)
+        self.out.write(data)
+
+    def finish(self):
+        # resolve forward references; returns the number of bytes written
+        self.resolve_fixups()
+        self.out.seek(self.pc)
+        return self.pc
+
 
-        if node.data == "instr":
-            binary.extend(encode_instruction(node, labels, len(binary), logger))
+def statements(tree):
+    # top-level nodes of a parse tree (a single statement collapses into the start node)
+    return tree.children if tree.data == "start" else [tree]
 
-    return binary
\ No newline at end of file
+
+def assemble_tree(tree, logger):
+    """
+    Generate the binary for a parse tree in one pass over its nodes.
+    Returns (binary, labels), labels mapping label names to addresses.
+    """
+    nodes = statements(tree)
+    logger.debug(f"Starting code generation for {len(nodes)} nodes...")
+    generator = CodeGenerator(logger)
+    for node in nodes:
+        generator.feed(node)
+    binary = generator.finish()
+
+    logger.debug(f"Finished resolving {len(generator.labels)} labels:")
+    for label, address in generator.labels.items():
+        logger.debug(f"    {label} = {address}")
+
+    return binary, generator.labels
+
+
+class SectionCodeGenerator(CodeGenerator):
+    """
+    Code generation for one label-delimited section, placed at address 0.
+    Every label operand becomes a fixup, even for labels defined in the section,
+    so the encoded bytes do not depend on where the section ends up.
+    Labels defined here are kept as offsets in `local`.
+    """
+
+    def __init__(self, logger):
+        super().__init__(logger)
+        self.local = {}
+
+    def label(self, label_name):
+        if label_name in self.local:
+            self.logger.error(f"Label {label_name} already defined. Exiting...")
+            exit(1)
+        self.local[label_name] = self.pc
+        self.logger.debug(f"Found label: {label_name} (at section offset {self.pc})")
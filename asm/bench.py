@@ -0,0 +1,89 @@
+"""
+Benchmark for the JASM parser.
+Usage: python bench.py [--lines N] [--repeat N] [--parsers lalr,earley]
+
+Times building the parser (Earley, LALR from scratch and LALR loaded from Lark's disk cache)
+and parsing programs/test.jasm and a synthetic program of N lines (default 100000) that uses
+every operand form and a label every ten lines. The best of --repeat runs is reported.
+Earley takes minutes on the large program; leave it out with --parsers lalr.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+from lark import Lark
+from util import GRAMMAR, PARSER_OPTIONS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEST_PROGRAM = os.path.join(os.path.dirname(HERE), "programs", "test.jasm")
+
+PARSERS = {
+    "earley": {},
+    "lalr": PARSER_OPTIONS,
+}
+
+
+def synthetic_program(lines:int, seed:int=0) -> str:
+    # a label every ten lines, then a random mix of all instruction forms
+    rng = random.Random(seed)
+    forms = [
+        "NOP", "HALT", "SEC", "INC A", "POP B", "PUSH C", "PUSH 0x10", "INT 0x01",
+        "MOVE A, B", "ADD A, 1", "SUB X, 0x20", "CMP D, b101", "OUTB A, 0x10", "INB B, 0x11",
+        "LOAD A, 0xC000", "STORE B, X:Y", "JMP {label}", "JNZ {label} ; back",
+    ]
+    out = []
+    labels = []
+    for i in range(lines):
+        if i % 10 == 0:
+            labels.append(f"label_{i}")
+            out.append(f"{labels[-1]}:")
+            continue
+        out.append("    " + rng.choice(forms).format(label=rng.choice(labels)))
+    return "\n".join(out) + "\n"
+
+
+def best(fn, repeat:int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Benchmark the JASM parser")
+    argparser.add_argument("--lines", type=int, default=100_000, help="Lines in the synthetic program")
+    argparser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is kept)")
+    argparser.add_argument("--parsers", default=",".join(PARSERS), help="Comma-separated parsers to measure")
+    args = argparser.parse_args(argv)
+
+    names = [p for p in args.parsers.split(",") if p]
+    for name in names:
+        if name not in PARSERS:
+            argparser.error(f"unknown parser {name!r} (have {', '.join(PARSERS)})")
+    sources = {
+        "test.jasm": open(TEST_PROGRAM).read(),
+        f"synthetic ({args.lines} lines)": synthetic_program(args.lines),
+    }
+
+    print(f"{'parser':<8} {'measurement':<32} {'seconds':>9}")
+    for name in names:
+        options = PARSERS[name]
+        builds = {"build": lambda: Lark(GRAMMAR, **{**options, "cache": False})}
+        if options.get("cache"):
+            Lark(GRAMMAR, **options)  # make sure the cache file exists
+            builds["build (disk cache)"] = lambda: Lark(GRAMMAR, **options)
+        for label, build in builds.items():
+            print(f"{name:<8} {label:<32} {best(build, args.repeat):>9.4f}", flush=True)
+        parser = Lark(GRAMMAR, **options)
+        for label, source in sources.items():
+            seconds = best(lambda: parser.parse(source), args.repeat)
+            print(f"{name:<8} {'parse ' + label:<32} {seconds:>9.4f}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Incremental assembly: label-delimited sections cached by content hash.
+Used by `jasm.py --incremental [--cache-dir DIR]`.
+
+The source is split into sections at every line that starts with a label. Each section is
+encoded on its own at address 0 (SectionCodeGenerator), with every label operand left as a
+fixup, so its bytes, size and label offsets depend only on its text. Those are cached under a
+hash of the text. Linking lays the sections out, resolves the labels and re-encodes the
+fixups. The linked bytes of each section are cached too, with the label addresses they were
+linked against, so a section is only re-linked when one of the labels it uses moves.
+
+The cache is one JSON file per source file in the cache directory. It is plain data (never
+pickle, so a planted cache file cannot run code), is discarded when the assembler itself
+changes and only keeps the sections of the last build.
+"""
+import os
+import re
+import json
+import hashlib
+
+from lark import Token
+
+from assembler import (
+    SectionCodeGenerator,
+    statements,
+    get_operand_value,
+    generate_instruction_binary
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# a section starts at every line beginning with "name:"
+SECTION_START = re.compile(r"\s*[A-Za-z_][A-Za-z0-9_]*\s*:")
+
+# the sources whose changes invalidate cached encodings
+TOOLCHAIN_FILES = ("assembler.py", "instructions.py", "util.py", "incremental.py")
+
+_toolchain = None
+
+
+def toolchain_hash():
+    global _toolchain
+    if _toolchain is None:
+        digest = hashlib.sha256()
+        for name in TOOLCHAIN_FILES:
+            with open(os.path.join(HERE, name), "rb") as f:
+                digest.update(f.read())
+        _toolchain = digest.hexdigest()
+    return _toolchain
+
+
+def split_sections(source):
+    # [(first line number, text)]; text before the first label is a section too
+    sections = []
+    lines = []
+    start = 1
+    for number, line in enumerate(source.splitlines(keepends=True), 1):
+        if lines and SECTION_START.match(line):
+            sections.append((start, "".join(lines)))
+            lines = []
+            start = number
+        lines.append(line)
+    if lines:
+        sections.append((start, "".join(lines)))
+    return sections
+
+
+def cache_path(cache_dir, file):
+    name = hashlib.sha256(os.path.abspath(file).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{name}.json")
+
+
+def entry_to_json(entry):
+    # operand tokens are stored as [type, value], bytes as hex
+    linked = entry["linked"]
+    return {
+        "size": entry["size"],
+        "labels": entry["labels"],
+        "code": entry["code"].hex(),
+        "fixups": [[pc, opcode, mode, [[op.type, op.value] for op in operands], line]
+                   for pc, opcode, mode, operands, line in entry["fixups"]],
+        "refs": entry["refs"],
+        "linked": None if linked is None else [list(linked[0]), linked[1].hex()],
+    }
+
+
+def entry_from_json(data):
+    linked = data["linked"]
+    return {
+        "size": int(data["size"]),
+        "labels": {str(name): int(offset) for name, offset in data["labels"].items()},
+        "code": bytes.fromhex(data["code"]),
+        "fixups": [(int(pc), int(opcode), int(mode), [Token(str(t), str(v)) for t, v in operands], int(line))
+                   for pc, opcode, mode, operands, line in data["fixups"]],
+        "refs": [str(name) for name in data["refs"]],
+        "linked": None if linked is None else (tuple(linked[0]), bytes.fromhex(linked[1])),
+    }
+
+
+def load_cache(path):
+    # a missing, stale or malformed cache is treated as empty
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if cache.get("toolchain") != toolchain_hash():
+            return {}
+        return {key: entry_from_json(data) for key, data in cache["sections"].items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+
+def save_cache(path, sections):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        json.dump({"toolchain": toolchain_hash(),
+                   "sections": {key: entry_to_json(entry) for key, entry in sections.items()}}, f)
+    os.replace(temp, path)
+
+
+def encode_section(get_parser, start, text, logger):
+    # cache entry for one section: its relocatable encoding
+    try:
+        tree = get_parser().parse(text)
+    except Exception as e:
+        logger.error(f"Syntax error in the section starting on line {start}: {e}")
+        exit(1)
+
+    generator = SectionCodeGenerator(logger)
+    for node in statements(tree):
+        if hasattr(node, "data") and node.data == "instr":
+            # tokens count lines from the start of the section
+            node.children[0].line += start - 1
+        generator.feed(node)
+
+    refs = [operand.value.strip()
+            for _, _, _, operands, _ in generator.fixups
+            for operand in operands if operand.type == "LABELNAME"]
+    return {
+        "size": generator.pc,
+        "labels": generator.local,
+        "code": bytes(generator.binary),
+        "fixups": generator.fixups,
+        "refs": refs,
+        # (label addresses linked against, linked bytes)
+        "linked": None,
+    }
+
+
+def link_section(entry, labels, logger):
+    code = bytearray(entry["code"])
+    for pc, opcode, addressing_mode, operands, line in entry["fixups"]:
+        values = [get_operand_value(operand, labels, logger) for operand in operands]
+        binary_instruction = generate_instruction_binary(opcode, values, addressing_mode, line, logger)
+        code[pc:pc + len(binary_instruction)] = binary_instruction
+    return bytes(code)
+
+
+def assemble_cached(file, get_parser, logger, cache_dir):
+    """
+    Assemble file, reusing the sections cached in cache_dir by earlier builds.
+    get_parser is only called when a section has to be parsed.
+    Returns (binary, labels) like assemble_tree.
+    """
+    path = cache_path(cache_dir, file)
+    cached = load_cache(path)
+    with open(file) as f:
+        sections = split_sections(f.read())
+
+    # encode (or look up) every section and lay them out
+    entries = []
+    labels = {}
+    pc = 0
+    encoded = 0
+    for start, text in sections:
+        key = hashlib.sha256(text.encode()).hexdigest()
+        entry = cached.get(key)
+        if entry is None:
+            entry = encode_section(get_parser, start, text, logger)
+            cached[key] = entry
+            encoded += 1
+        for name, offset in entry["labels"].items():
+            if name in labels:
+                logger.error(f"Label {name} already defined. Exiting...")
+                exit(1)
+            labels[name] = pc + offset
+        entries.append((key, entry))
+        pc += entry["size"]
+
+    # link: only sections using a label that moved are re-encoded
+    binary = bytearray()
+    linked = 0
+    for key, entry in entries:
+        addresses = tuple(labels.get(name) for name in entry["refs"])
+        if entry["linked"] is None or entry["linked"][0] != addresses:
+            entry["linked"] = (addresses, link_section(entry, labels, logger))
+            linked += 1
+        binary.extend(entry["linked"][1])
+
+    logger.debug(f"{len(sections)} sections: {encoded} encoded, {linked} linked, "
+                 f"{len(sections) - encoded} from the cache.")
+
+    save_cache(path, dict(entries))
+    return binary, labels
@@ -97,9 +97,10 @@ def get_operands(node):
     else:
         return []
 
-def validate_instruction_semantics(node, logger):
+def validate_instruction_semantics(node, logger, line=None):
     """
     Validate that an instruction has the correct number and types of operands.
+    line is the source line for error messages (default: the mnemonic token's line).
     """
     def validate_num_operands(required_num, actual_num, mnemonic, current_line):
         if actual_num != required_num:
@@ -117,7 +118,8 @@ def validate_instruction_semantics(node, logger):
             exit(1)
 
     mnemonic = node.children[0].value.upper()    
-    line = node.children[0].line
+    if line is None:
+        line = node.children[0].line
 
     # Handle optional operand_list
     operands = get_operands(node)
@@ -1,21 +1,46 @@
 import argparse
+import contextlib
+import functools
+import glob
+import io
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from util import Logger, GRAMMAR
+from util import Logger, GRAMMAR, PARSER_OPTIONS
 from lark import Lark
-from assembler import resolve_labels, generate_binary
+from assembler import assemble_tree, statements, StreamingCodeGenerator
+from incremental import assemble_cached
 
 # JASM assembler written in Python.
-# Usage: python jasm.py <file> [-o <output file>] [-d <debug>] 
+# Usage: python jasm.py <file> [-o <output file>] [-s <symbol file>] [--stream | --incremental [--cache-dir <dir>]] [-d <debug>] 
+#        python jasm.py <file | glob | @manifest>... [-o <output dir>] [-s <symbol dir>] [-j <jobs>] ...
+# With several inputs (or a glob or manifest), the files are assembled in a process pool and
+# -o / -s name directories; by default each binary is written next to its source.
+# A manifest lists one "source [output]" per line (relative to the manifest, # starts a comment).
 
 logger = None
+parser = None
+
+# parse trees kept for repeated lines by assemble_stream
+STREAM_CACHE_LINES = 4096
+
+# --incremental keeps its section cache here, next to the source, unless --cache-dir is given
+CACHE_DIR = ".jasm-cache"
+
+
+def get_parser():
+    # built once per process (and loaded from Lark's disk cache after the first run)
+    global parser
+    if parser is None:
+        parser = Lark(GRAMMAR, **PARSER_OPTIONS)
+    return parser
 
 
 def parse(file):
     logger.debug("Parsing...")
     try:
-        parser = Lark(GRAMMAR)
-        tree = parser.parse(open(file).read())
+        tree = get_parser().parse(open(file).read())
     except Exception as e:
         logger.error(f"Syntax error: {e}")
         exit(1)
@@ -23,18 +48,30 @@ def parse(file):
     return tree
 
 
-def assemble(file, output):
+def write_symbols(labels, path):
+    # one "ADDR name" line per label, by address (read by the emulator's profiler)
+    with open(path, 'w') as f:
+        for name, address in sorted(labels.items(), key=lambda item: item[1]):
+            f.write(f"{address:04X} {name}\n")
+
+
+def assemble(file, output, symbols=None, cache_dir=None):
 
     logger.info(f"Assembling {file}...")
 
-    # Parse the source file
-    tree = parse(file)
-    
-    # Pass 1: Resolve labels
-    labels = resolve_labels(tree, logger)
-    
-    # Pass 2: Generate binary
-    binary = generate_binary(tree, labels, logger)
+    if cache_dir:
+        # Reuse the sections that did not change since the last build
+        binary, labels = assemble_cached(file, get_parser, logger, cache_dir)
+    else:
+        # Parse the source file
+        tree = parse(file)
+
+        # Generate binary (forward label references are patched at the end)
+        binary, labels = assemble_tree(tree, logger)
+
+    if symbols:
+        write_symbols(labels, symbols)
+        logger.debug(f"Wrote {len(labels)} symbols to {symbols}.")
     
     # Write binary to output file
     with open(output, 'wb') as f:
@@ -44,10 +81,207 @@ def assemble(file, output):
 
     return len(binary)
 
+
+def assemble_stream(file, output, symbols=None):
+    # parse and encode one source line at a time, writing the binary as it
+    # goes. nothing but the labels and the pending forward references is kept,
+    # so this works on generated sources of any size. a statement must not
+    # span lines (it never does in hand-written JASM)
+
+    logger.info(f"Assembling {file} (streaming)...")
+    # generated sources repeat the same lines a lot; the trees are only read,
+    # so recent ones are reused (the line number is passed to feed instead)
+    parse_line = functools.lru_cache(maxsize=STREAM_CACHE_LINES)(get_parser().parse)
+
+    # the binary goes to a temp file next to the output and only replaces it
+    # once every fixup is patched, so a failed build leaves no partial binary
+    temp = output + ".tmp"
+    try:
+        with open(file) as source, open(temp, 'wb') as out:
+            generator = StreamingCodeGenerator(logger, out)
+            for number, text in enumerate(source, 1):
+                code = text.partition(";")[0]
+                if not code.strip():
+                    continue
+                try:
+                    tree = parse_line(text)
+                except Exception as e:
+                    logger.error(f"Syntax error on line {number}: {e}")
+                    exit(1)
+
+                # tokens count lines from the start of the text they were parsed from
+                for node in statements(tree):
+                    generator.feed(node, number)
+            size = generator.finish()
+        os.replace(temp, output)
+    except BaseException:
+        # errors exit, so SystemExit lands here too
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+    if symbols:
+        write_symbols(generator.labels, symbols)
+        logger.debug(f"Wrote {len(generator.labels)} symbols to {symbols}.")
+
+    logger.debug(f"Generated {size} bytes of binary code.")
+
+    return size
+
+# ---------------- batch assembly ----------------
+def is_glob(name):
+    return any(c in name for c in "*?[")
+
+
+def expand_inputs(names):
+    # (source, output or None) for every file, glob match and manifest line
+    inputs = []
+    for name in names:
+        if name.startswith("@"):
+            manifest = name[1:]
+            base = os.path.dirname(manifest)
+            try:
+                with open(manifest) as f:
+                    lines = f.read().splitlines()
+            except OSError as e:
+                logger.error(f"Cannot read manifest {manifest}: {e}. Exiting...")
+                exit(1)
+            for line in lines:
+                fields = line.partition("#")[0].split()
+                if not fields:
+                    continue
+                source = os.path.join(base, fields[0])
+                if is_glob(source):
+                    inputs.extend((match, None) for match in sorted(glob.glob(source, recursive=True)))
+                else:
+                    inputs.append((source, os.path.join(base, fields[1]) if len(fields) > 1 else None))
+        elif is_glob(name):
+            matches = sorted(glob.glob(name, recursive=True))
+            if not matches:
+                logger.error(f"No files match {name}.")
+            inputs.extend((match, None) for match in matches)
+        else:
+            inputs.append((name, None))
+    return inputs
+
+
+def output_path(source, output, directory, extension):
+    # an explicit output, else <name><extension> in directory (or next to the source)
+    if output:
+        return output
+    name = os.path.splitext(os.path.basename(source))[0] + extension
+    return os.path.join(directory if directory else os.path.dirname(source), name)
+
+
+def check_source(file):
+    if not os.path.exists(file):
+        logger.error(f"File {file} does not exist. Exiting...")
+        exit(1)
+    if not file.endswith(".jasm"):
+        logger.error(f"File {file} is not a JASM file. Exiting...")
+        exit(1)
+
+
+def assemble_file(file, output, symbols, stream, incremental, cache_dir):
+    # one assembly as selected on the command line; returns the size
+    if stream:
+        return assemble_stream(file, output, symbols)
+    if incremental:
+        cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(file)), CACHE_DIR)
+        return assemble(file, output, symbols, cache_dir)
+    return assemble(file, output, symbols)
+
+
+def init_worker(verbosity):
+    # each pool process gets its own logger and parser
+    global logger
+    logger = Logger(verbosity)
+    get_parser()
+
+
+def assemble_job(file, output, symbols, stream, incremental, cache_dir):
+    # (size or None if it failed, seconds, log); errors exit, so they are caught here
+    log = io.StringIO()
+    start = time.perf_counter()
+    size = None
+    with contextlib.redirect_stdout(log):
+        try:
+            check_source(file)
+            size = assemble_file(file, output, symbols, stream, incremental, cache_dir)
+        except SystemExit:
+            pass
+        except Exception as e:
+            logger.error(f"{type(e).__name__}: {e}")
+        logger.flush_debug()
+    return size, time.perf_counter() - start, log.getvalue()
+
+
+def assemble_batch(inputs, args):
+    # assemble every input, in a process pool unless there is only one job; returns the failure count
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    if args.symbols:
+        os.makedirs(args.symbols, exist_ok=True)
+
+    jobs = []
+    results = {}
+    written = {}
+    for source, output in inputs:
+        output = output_path(source, output, args.output, ".bin")
+        symbols = output_path(source, None, args.symbols, ".sym") if args.symbols else None
+        if output in written:
+            results[len(jobs)] = (None, 0.0, f"ERROR: {output} is also the output of {written[output]}\n")
+        written[output] = source
+        jobs.append((source, output, symbols, args.stream, args.incremental, args.cache_dir))
+
+    todo = [i for i in range(len(jobs)) if i not in results]
+    workers = min(args.jobs or os.cpu_count() or 1, len(todo))
+    logger.debug(f"Assembling {len(todo)} files with {workers} worker(s)...")
+    start = time.perf_counter()
+    if workers <= 1:
+        # serial: this process's logger and parser
+        get_parser()
+        for i in todo:
+            results[i] = assemble_job(*jobs[i])
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(args.verbosity,)) as pool:
+            futures = {i: pool.submit(assemble_job, *jobs[i]) for i in todo}
+            for i, future in futures.items():
+                results[i] = future.result()
+    elapsed = time.perf_counter() - start
+
+    # summary, in input order; the log of a file is shown if it failed (or always with -v 2)
+    width = max(len(job[0]) for job in jobs)
+    failed = 0
+    for i, (source, output, *_) in enumerate(jobs):
+        size, seconds, log = results[i]
+        if size is None:
+            failed += 1
+        if log and (size is None or args.verbosity >= Logger.Level.DEBUG):
+            logger.info(f"--- {source}")
+            logger.info(log.rstrip("\n"))
+    logger.info("")
+    logger.info(f"{'file':<{width}}  {'bytes':>7}  {'seconds':>8}  output")
+    for i, (source, output, *_) in enumerate(jobs):
+        size, seconds, log = results[i]
+        if size is None:
+            logger.info(f"{source:<{width}}  {'-':>7}  {seconds:>8.3f}  FAILED")
+        else:
+            logger.info(f"{source:<{width}}  {size:>7}  {seconds:>8.3f}  {output}")
+    logger.info(f"{len(jobs)} files in {elapsed:.3f} s with {workers} worker(s).")
+    logger.info("")
+    return failed
+
+
 def main():
     argparser = argparse.ArgumentParser(description="JASM assembler")
-    argparser.add_argument("file", nargs="?", default="", help="The file to assemble")
-    argparser.add_argument("-o", "--output", default="a.bin", help="The output file")
+    argparser.add_argument("files", nargs="*", help="Files to assemble: paths, globs or @manifest files")
+    argparser.add_argument("-o", "--output", default=None, help="The output file (default a.bin), or directory for several inputs")
+    argparser.add_argument("-s", "--symbols", default=None, help="Also write label addresses to this file (directory for several inputs)")
+    argparser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes for several inputs (default: CPU count)")
+    argparser.add_argument("--stream", action="store_true", help="Assemble line by line without building the whole parse tree")
+    argparser.add_argument("--incremental", action="store_true", help="Only re-encode the label sections that changed since the last build")
+    argparser.add_argument("--cache-dir", default=None, help=f"Section cache for --incremental (default: {CACHE_DIR} next to the source)")
     argparser.add_argument("-v", "--verbosity", help="Verbosity level", default=Logger.Level.INFO, type=int)
     args = argparser.parse_args()
 
@@ -58,29 +292,41 @@ def main():
     logger.info("")
 
     # check if file is provided
-    if not args.file:
+    if not args.files:
         logger.error("No file(s) provided. Exiting...")
         exit(1)
 
-    # check if file exists
-    if not os.path.exists(args.file):
-        logger.error(f"File {args.file} does not exist. Exiting...")
+    if args.stream and args.incremental:
+        logger.error("--stream and --incremental cannot be combined. Exiting...")
         exit(1)
 
-    # check if file is an assembly file
-    if not args.file.endswith(".jasm"):
-        logger.error(f"File {args.file} is not a JASM file. Exiting...")
-        exit(1)
+    # several inputs: assemble them all and report the failures at the end
+    single = args.files[0]
+    if len(args.files) > 1 or is_glob(single) or single.startswith("@"):
+        inputs = expand_inputs(args.files)
+        if not inputs:
+            logger.error("No file(s) to assemble. Exiting...")
+            exit(1)
+        failed = assemble_batch(inputs, args)
+        if failed:
+            logger.error(f"{failed} of {len(inputs)} files failed.")
+            exit(1)
+        logger.success("Assembly complete! Yay!")
+        logger.info("")
+        exit(0)
+
+    check_source(single)
+    output = args.output or "a.bin"
     
     logger.debug("Init looks good. Starting assembly...")
 
     # the magic
-    size = assemble(args.file, args.output)
+    size = assemble_file(single, output, args.symbols, args.stream, args.incremental, args.cache_dir)
 
     if logger.level == Logger.Level.DEBUG:
         logger.flush_debug()
         logger.info("")
-    logger.info(f"Wrote {size} bytes to {args.output}.")
+    logger.info(f"Wrote {size} bytes to {output}.")
     logger.success("Assembly complete! Yay!")
     logger.info("")
 
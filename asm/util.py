@@ -8,7 +8,7 @@ GRAMMAR = r"""
     ?line: instr # Lines contain an instruction or a label
          | label
 
-    label: LABELNAME ":"
+    label: LABEL ":"
 
     instr: MNEMONIC operand_list?
 
@@ -35,6 +35,9 @@ GRAMMAR = r"""
     NUMBER.20: /0[xX][0-9a-fA-F]+/i
           | /[bB][01]+/
           | /[0-9]+/
+    # a name followed by a colon starts a label. LALR decides with one token
+    # of lookahead, so "HALT" followed by "loop:" must not lex "loop" as an operand
+    LABEL.30: /[A-Za-z_][A-Za-z0-9_]*(?=\s*:)/
     LABELNAME.10: /[A-Za-z_][A-Za-z0-9_]*/
 
     # Lark provides common definitions for whitespace.
@@ -44,6 +47,11 @@ GRAMMAR = r"""
     %ignore COMMENT
 """
 
+# deterministic LALR(1) with the contextual lexer. cache=True stores the
+# built parser in the temp directory under a hash of the grammar and these
+# options, so only the first run after a grammar change compiles it
+PARSER_OPTIONS = {"parser": "lalr", "lexer": "contextual", "cache": True}
+
 class Logger: 
     class Level:
         VERBOSE = 3
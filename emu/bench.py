@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the emulator hot path.
+Usage:
+    python bench.py [--engines step,block] [--repeat N] [--only NAME ...]
+                    [--baseline FILE] [--save-baseline FILE] [--tolerance FRACTION]
+
+Every workload is a JASM source in programs/bench/ (tight ALU loop, memory copy, stack churn,
+branch-heavy code, port I/O). Each one is assembled with jasm.py and run with `emulator.py run`
+in a fresh process for every engine and repeat, so peak RSS belongs to that run alone. The best
+of N repeats is reported as instructions/sec, ns/instruction and peak RSS.
+
+--save-baseline stores the results as JSON. --baseline compares against such a file: any
+workload/engine that is more than --tolerance slower (or retires a different number of
+instructions) is reported as a REGRESSION and the exit status is 1.
+For a per-function breakdown of one workload use `emulator.py run <bin> --cprofile`.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BENCH_DIR = os.path.join(ROOT, "programs", "bench")
+JASM = os.path.join(ROOT, "asm", "jasm.py")
+EMULATOR = os.path.join(HERE, "emulator.py")
+
+ENGINES = ("step", "block")
+# allowed slowdown against the baseline before a run counts as a regression
+DEFAULT_TOLERANCE = 0.15
+
+
+# ---------------- workloads ----------------
+def find_workloads(only=None) -> dict:
+    names = sorted(n[:-len(".jasm")] for n in os.listdir(BENCH_DIR) if n.endswith(".jasm"))
+    if only:
+        missing = set(only) - set(names)
+        if missing:
+            raise SystemExit(f"unknown workload(s): {', '.join(sorted(missing))} (have: {', '.join(names)})")
+        names = [n for n in names if n in only]
+    return {n: os.path.join(BENCH_DIR, n + ".jasm") for n in names}
+
+
+def assemble(source:str, output:str):
+    proc = subprocess.run([sys.executable, JASM, source, "-o", output], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"assembling {source} failed:\n{proc.stdout}{proc.stderr}")
+
+
+def run_once(binary:str, engine:str) -> dict:
+    proc = subprocess.run([sys.executable, EMULATOR, "run", binary, "--engine", engine],
+                          capture_output=True, text=True)
+    report = json.loads(proc.stdout)
+    if report["status"] != 'halted':
+        raise RuntimeError(f"{binary} ({engine}) did not halt: {report.get('error', report['status'])}")
+    return report
+
+
+def measure(binary:str, engine:str, repeat:int) -> dict:
+    runs = [run_once(binary, engine) for _ in range(repeat)]
+    best = min(runs, key=lambda r: r["wall_time"])
+    return {
+        "instructions": best["instructions"],
+        "ips": best["ips"],
+        "ns_per_instruction": 1e9 * best["wall_time"] / best["instructions"],
+        "max_rss_kb": max((r["max_rss_kb"] or 0) for r in runs) or None,
+    }
+
+
+# ---------------- baseline ----------------
+def compare(results:dict, baseline:dict, tolerance:float) -> list:
+    problems = []
+    for name, engines in results.items():
+        for engine, r in engines.items():
+            base = baseline.get("results", {}).get(name, {}).get(engine)
+            if base is None:
+                continue
+            if r["instructions"] != base["instructions"]:
+                problems.append(f"{name}/{engine}: retired {r['instructions']} instructions, "
+                                f"baseline {base['instructions']}")
+            elif r["ips"] < base["ips"] * (1 - tolerance):
+                problems.append(f"{name}/{engine}: {r['ips'] / 1e6:.3f}M instr/s, baseline "
+                                f"{base['ips'] / 1e6:.3f}M ({100 * (r['ips'] / base['ips'] - 1):+.1f}%)")
+    return problems
+
+
+# ---------------- main ----------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the JOKOR emulator")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="Comma-separated engines to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per workload and engine (best is kept)")
+    parser.add_argument("--only", nargs="+", default=None, metavar="NAME", help="Only run these workloads")
+    parser.add_argument("--baseline", default=None, metavar="FILE", help="Fail on regressions against this file")
+    parser.add_argument("--save-baseline", default=None, metavar="FILE", help="Save the results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown against the baseline as a fraction (default 0.15)")
+    args = parser.parse_args(argv)
+
+    engines = [e for e in args.engines.split(",") if e]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"unknown engine {engine!r}")
+    workloads = find_workloads(args.only)
+
+    results = {}
+    print(f"{'workload':<10} {'engine':<6} {'instructions':>12} {'Minstr/s':>9} {'ns/instr':>9} {'peak RSS':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, source in workloads.items():
+            binary = os.path.join(tmp, name + ".bin")
+            assemble(source, binary)
+            results[name] = {}
+            for engine in engines:
+                r = results[name][engine] = measure(binary, engine, args.repeat)
+                rss = f"{r['max_rss_kb'] / 1024:.1f} MiB" if r["max_rss_kb"] else "n/a"
+                print(f"{name:<10} {engine:<6} {r['instructions']:>12} {r['ips'] / 1e6:>9.3f} "
+                      f"{r['ns_per_instruction']:>9.0f} {rss:>10}", flush=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fh:
+            json.dump({"python": platform.python_version(), "results": results}, fh, indent=2)
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        problems = compare(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        if problems:
+            return 1
+        print(f"no regressions against {args.baseline} (tolerance {100 * args.tolerance:.0f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
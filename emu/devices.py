@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+I/O devices for the JOKOR port bus.
+Usage (from the batch runner):
+    python emulator.py run prog.bin --device console@10 --device timer@20:5000,irq=1 --device disk@30:disk.img
+
+A device is any object with a `ports` list and read/write/poll/attach/close methods (subclass
+Device); CPU.attach() gives it those ports, so INB/OUTB on them call device.read / device.write.
+Everything else runs in between instructions: the CPU calls device.poll() every
+cpu.poll_interval instructions (DEVICE_POLL_INTERVAL by default), never per instruction.
+
+Devices that get input from outside (a keyboard thread, an asyncio stream, a disk worker) derive
+from QueuedDevice: producers post() items from any thread or event loop and poll() hands them to
+receive() on the CPU thread, so the CPU loop never blocks on a device and read/write need no lock.
+
+A device with an `irq` line (`,irq=N` on the command line) raises it with cpu.raise_irq():
+the console when input arrives, the timer on every tick and the disk when a command finishes.
+
+Port maps (relative to the base port):
+    console  +0 data (INB: next input byte or 0, OUTB: output byte)
+             +1 status (bit 0: input available, bit 1: output ready)
+    timer    +0 ticks since start or the last OUTB to it (low byte; one tick every PERIOD instructions,
+             or PERIOD cycles with --cycles)
+    disk     +0 command/status (OUTB 1: read block, 2: write block; INB bit 0: busy, bit 1: error)
+             +1 / +2 block number low / high, +3 data (sequential through the 256-byte buffer)
+"""
+import os
+import sys
+import queue
+import asyncio
+import threading
+from collections import deque
+
+CONSOLE_INPUT = 0x01
+CONSOLE_OUTPUT_READY = 0x02
+
+DISK_BLOCK_SIZE = 256
+DISK_READ  = 1
+DISK_WRITE = 2
+DISK_BUSY  = 0x01
+DISK_ERROR = 0x02
+
+TIMER_PERIOD = 1000
+
+
+# ---------------- base classes ----------------
+class Device:
+    # something on the port bus. subclasses set ports (the port numbers they
+    # claim) and override what they need; all methods run on the CPU thread
+    ports = ()
+    # IRQ line raised by interrupt(), or None for a polled-only device
+    irq = None
+
+    def attach(self, cpu):
+        pass
+
+    def read(self, cpu, port:int) -> int:
+        return cpu.ports[port]
+
+    def write(self, cpu, port:int, val:int):
+        pass
+
+    def poll(self, cpu):
+        pass
+
+    def idle(self, cpu, port:int) -> bool:
+        # True if reading port returns the same value without side effects
+        # until the next poll (lets the CPU skip loops spinning on it)
+        return True
+
+    def next_event(self, cpu):
+        # cpu.clock value at which the device next changes on its own,
+        # or None if that can happen at any poll (input from outside)
+        return None
+
+    def close(self):
+        pass
+
+    def interrupt(self, cpu):
+        if self.irq is not None:
+            cpu.raise_irq(self.irq)
+
+    def __repr__(self):
+        return f"{type(self).__name__}@{self.ports[0]:02X}" if self.ports else type(self).__name__
+
+
+class QueuedDevice(Device):
+    # a device fed from other threads or an asyncio event loop: producers
+    # post() items (deque appends are atomic) and poll() hands them to
+    # receive() on the CPU thread
+    def __init__(self):
+        self.inbox = deque()
+        self.workers = []
+
+    def post(self, item):
+        self.inbox.append(item)
+
+    def poll(self, cpu):
+        inbox = self.inbox
+        while inbox:
+            self.receive(cpu, inbox.popleft())
+
+    def receive(self, cpu, item):
+        pass
+
+    def start_thread(self, target, *args) -> threading.Thread:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.workers.append(thread)
+        return thread
+
+    def start_async(self, coro, loop=None):
+        # run coro on loop: pass the loop when calling from another thread,
+        # leave it out when already running inside the loop
+        if loop is None:
+            return asyncio.get_running_loop().create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+
+# ---------------- devices ----------------
+class Console(QueuedDevice):
+    # byte console. input arrives as posted bytes (feed(), a stdin thread or
+    # an asyncio StreamReader); output is buffered and written out on poll
+    def __init__(self, port:int, out=None, irq:int=None):
+        super().__init__()
+        self.ports = [port, (port + 1) & 0xFF]
+        self.irq = irq
+        self.out = sys.stdout.buffer if out is None else out
+        self.input = deque()
+        self.output = bytearray()
+
+    def feed(self, data:bytes):
+        self.post(bytes(data))
+
+    def start_stdin(self, stream=None):
+        stream = sys.stdin.buffer if stream is None else stream
+        return self.start_thread(self._pump_stream, stream)
+
+    def _pump_stream(self, stream):
+        while True:
+            data = stream.read1(4096) if hasattr(stream, "read1") else stream.read(1)
+            if not data:
+                return
+            self.post(data)
+
+    async def pump(self, reader):
+        # feed from an asyncio StreamReader until EOF
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                return
+            self.post(data)
+
+    def receive(self, cpu, item):
+        self.input.extend(item)
+        self.interrupt(cpu)
+
+    def idle(self, cpu, port:int) -> bool:
+        return port != self.ports[0] or not self.input
+
+    def read(self, cpu, port:int) -> int:
+        if port == self.ports[0]:
+            return self.input.popleft() if self.input else 0
+        return (CONSOLE_INPUT if self.input else 0) | CONSOLE_OUTPUT_READY
+
+    def write(self, cpu, port:int, val:int):
+        if port == self.ports[0]:
+            self.output.append(val)
+
+    def poll(self, cpu):
+        super().poll(cpu)
+        self.flush()
+
+    def flush(self):
+        if self.output:
+            self.out.write(bytes(self.output))
+            self.out.flush()
+            self.output.clear()
+
+    def close(self):
+        self.flush()
+
+
+class Timer(Device):
+    # counts one tick every `period` instructions, or cycles when the CPU
+    # counts them (cpu.clock). the count is updated when the device is
+    # polled, so it is as precise as the CPU's poll interval
+    def __init__(self, port:int, period:int=TIMER_PERIOD, irq:int=None):
+        if period < 1:
+            raise ValueError("timer period must be at least 1")
+        self.ports = [port]
+        self.irq = irq
+        self.period = period
+        self.start = 0
+        self.ticks = 0
+
+    def attach(self, cpu):
+        self.start = cpu.clock
+
+    def read(self, cpu, port:int) -> int:
+        return self.ticks & 0xFF
+
+    def write(self, cpu, port:int, val:int):
+        self.start = cpu.clock
+        self.ticks = 0
+
+    def next_event(self, cpu):
+        return self.start + (self.ticks + 1) * self.period
+
+    def poll(self, cpu):
+        ticks = (cpu.clock - self.start) // self.period
+        if ticks != self.ticks:
+            self.ticks = ticks
+            self.interrupt(cpu)
+
+
+class BlockDevice(QueuedDevice):
+    # file-backed disk of 256-byte blocks. reads and writes run on a worker
+    # thread; the status port reports busy until the result has been polled in
+    def __init__(self, port:int, path:str, irq:int=None):
+        super().__init__()
+        self.ports = [(port + i) & 0xFF for i in range(4)]
+        self.irq = irq
+        self.path = path
+        self.fh = open(path, "r+b") if os.path.exists(path) else open(path, "w+b")
+        self.block = 0
+        self.buffer = bytearray(DISK_BLOCK_SIZE)
+        self.pos = 0
+        self.status = 0
+        self.requests = queue.SimpleQueue()
+        self.start_thread(self._worker)
+
+    def _worker(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            command, block, data = request
+            try:
+                self.fh.seek(block * DISK_BLOCK_SIZE)
+                if command == DISK_READ:
+                    data = self.fh.read(DISK_BLOCK_SIZE).ljust(DISK_BLOCK_SIZE, b"\0")
+                else:
+                    self.fh.write(data)
+                    self.fh.flush()
+                self.post((command, data, None))
+            except OSError as e:
+                self.post((command, None, e))
+
+    def receive(self, cpu, item):
+        command, data, error = item
+        if error is not None:
+            self.status = DISK_ERROR
+        else:
+            if command == DISK_READ:
+                self.buffer[:] = data
+            self.pos = 0
+            self.status = 0
+        self.interrupt(cpu)
+
+    def idle(self, cpu, port:int) -> bool:
+        # data reads move through the buffer
+        return port != self.ports[3]
+
+    def read(self, cpu, port:int) -> int:
+        match self.ports.index(port):
+            case 0:
+                return self.status
+            case 1:
+                return self.block & 0xFF
+            case 2:
+                return self.block >> 8
+            case _:
+                val = self.buffer[self.pos]
+                self.pos = (self.pos + 1) % DISK_BLOCK_SIZE
+                return val
+
+    def write(self, cpu, port:int, val:int):
+        match self.ports.index(port):
+            case 0:
+                if self.status & DISK_BUSY:
+                    return
+                if val not in (DISK_READ, DISK_WRITE):
+                    self.status = DISK_ERROR
+                    return
+                self.status = DISK_BUSY
+                self.requests.put((val, self.block, bytes(self.buffer) if val == DISK_WRITE else None))
+            case 1:
+                self.block = (self.block & 0xFF00) | val
+                self.pos = 0
+            case 2:
+                self.block = (val << 8) | (self.block & 0xFF)
+                self.pos = 0
+            case _:
+                self.buffer[self.pos] = val
+                self.pos = (self.pos + 1) % DISK_BLOCK_SIZE
+
+    def close(self):
+        self.requests.put(None)
+        for thread in self.workers:
+            thread.join()
+        self.fh.close()
+
+
+# ---------------- command line ----------------
+def make_device(spec:str, out=None) -> Device:
+    # "kind@PORT[:arg][,irq=N]" with PORT in hex, e.g. console@10,irq=2, timer@20:5000, disk@30:disk.img
+    spec, _, option = spec.partition(",irq=")
+    irq = int(option, 0) if option else None
+    kind, _, rest = spec.partition("@")
+    port, _, arg = rest.partition(":")
+    if not port:
+        raise ValueError(f"device {spec!r}: expected kind@PORT[:arg][,irq=N]")
+    port = int(port, 16) & 0xFF
+    match kind:
+        case "console":
+            console = Console(port, out, irq)
+            console.start_stdin()
+            return console
+        case "timer":
+            return Timer(port, int(arg) if arg else TIMER_PERIOD, irq)
+        case "disk":
+            if not arg:
+                raise ValueError(f"device {spec!r}: disk needs a file, e.g. disk@30:disk.img")
+            return BlockDevice(port, arg, irq)
+    raise ValueError(f"unknown device kind {kind!r} (have console, timer, disk)")
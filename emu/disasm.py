@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Table-driven JOKOR disassembler.
+Usage:
+    python disasm.py <binary|snapshot> [--base HEX] [--start HEX] [--end HEX] [-s SYMBOLS] [-o OUT]
+
+Opcode, register and addressing-mode names and instruction sizes come from asm/instructions.py,
+so the listing reads back as JASM. Decoding goes through FIRST_BYTE, one precomputed entry per
+possible first byte (mnemonic, mode, size), and operands are formatted from per-byte string
+tables, so a linear sweep over a full 64 KiB image takes a fraction of a second.
+
+The range defaults to the loaded bytes. A snapshot file (emulator.py run --save-snapshot) starts
+with the 64 KiB memory image, so `disasm.py warm.snap` lists the whole machine. With a symbol
+file from `jasm -s`, labels are printed before their address and used for jump and memory
+operands.
+"""
+import os
+import sys
+import argparse
+from typing import Tuple, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# appended, so modules in emu/ (bench.py) are not shadowed by asm/
+sys.path.append(os.path.join(os.path.dirname(HERE), "asm"))
+
+from instructions import OPCODES, REGISTERS, ADDRESSING_MODES, ADDRESSING_MODE_TO_SIZE
+from symbols import MEM_SIZE, SymbolTable
+
+MODE_NO_OPERANDS = ADDRESSING_MODES["NO_OPERANDS"]
+MODE_REGISTER = ADDRESSING_MODES["REGISTER"]
+MODE_IMM8 = ADDRESSING_MODES["IMM8"]
+MODE_REGISTER_REGISTER = ADDRESSING_MODES["REGISTER_REGISTER"]
+MODE_REGISTER_IMM8 = ADDRESSING_MODES["REGISTER_IMM8"]
+MODE_REGISTER_IMM16 = ADDRESSING_MODES["REGISTER_IMM16_ADDRESS"]
+MODE_REGISTER_PAIR = ADDRESSING_MODES["REGISTER_REGPAIR_ADDRESS"]
+MODE_IMM16 = ADDRESSING_MODES["IMM16"]
+
+# register codes 0xC..0xF have no name in JASM
+REG_NAMES = [f"R{code}" for code in range(16)]
+for _name, _code in REGISTERS.items():
+    REG_NAMES[_code] = _name
+
+MNEMONICS = {code: name for name, code in OPCODES.items()}
+# first byte -> (mnemonic, mode, size)
+FIRST_BYTE = [(MNEMONICS[b >> 3], b & 0b111, ADDRESSING_MODE_TO_SIZE[b & 0b111]) for b in range(256)]
+
+# operand text by operand byte: the register in the high nibble, both
+# registers, the register pair (high nibble first, as written in JASM), imm8
+HIGH_REG = [REG_NAMES[b >> 4] for b in range(256)]
+REG_REG = [f"{REG_NAMES[b >> 4]}, {REG_NAMES[b & 0x0F]}" for b in range(256)]
+REG_PAIR = [f"{REG_NAMES[b >> 4]}:{REG_NAMES[b & 0x0F]}" for b in range(256)]
+IMM8 = [f"0x{b:02X}" for b in range(256)]
+
+
+# ---------------- decoding ----------------
+def label_map(symbols:Optional[SymbolTable]) -> dict:
+    # address -> label name, for exact matches only
+    return {} if symbols is None else dict(zip(symbols.addrs, symbols.names))
+
+
+def instruction(memory, addr:int, labels:Optional[dict]=None) -> Tuple[int, str]:
+    # (size, JASM text) of the instruction at addr in a 64 KiB memory image
+    mnemonic, mode, size = FIRST_BYTE[memory[addr]]
+    if mode == MODE_NO_OPERANDS:
+        return size, mnemonic
+    b1 = memory[(addr + 1) & 0xFFFF]
+    if mode == MODE_REGISTER:
+        return size, f"{mnemonic} {HIGH_REG[b1]}"
+    if mode == MODE_REGISTER_REGISTER:
+        return size, f"{mnemonic} {REG_REG[b1]}"
+    b2 = memory[(addr + 2) & 0xFFFF]
+    if mode == MODE_REGISTER_IMM8:
+        return size, f"{mnemonic} {HIGH_REG[b1]}, {IMM8[b2]}"
+    if mode == MODE_IMM8:
+        return size, f"{mnemonic} {IMM8[b2]}"
+    if mode == MODE_REGISTER_PAIR:
+        return size, f"{mnemonic} {HIGH_REG[b1]}, {REG_PAIR[b2]}"
+    target = b2 | memory[(addr + 3) & 0xFFFF] << 8
+    name = labels.get(target) if labels else None
+    if name is None:
+        name = f"0x{target:04X}"
+    if mode == MODE_REGISTER_IMM16:
+        return size, f"{mnemonic} {HIGH_REG[b1]}, {name}"
+    return size, f"{mnemonic} {name}"
+
+
+def decoded_bytes(decoded) -> bytes:
+    # instruction bytes for a decoded tuple (opcode, mode, operands...) as
+    # CPU.decode returns it; the bits the decoder drops are zero
+    opcode, mode = decoded[0], decoded[1]
+    first = opcode << 3 | mode
+    if mode == MODE_NO_OPERANDS:
+        return bytes((first,))
+    if mode == MODE_REGISTER:
+        return bytes((first, decoded[2] << 4))
+    if mode == MODE_IMM8:
+        return bytes((first, 0, decoded[2]))
+    if mode == MODE_REGISTER_REGISTER:
+        return bytes((first, decoded[2] << 4 | decoded[3]))
+    if mode in (MODE_REGISTER_IMM8, MODE_REGISTER_PAIR):
+        return bytes((first, decoded[2] << 4, decoded[3]))
+    if mode == MODE_REGISTER_IMM16:
+        return bytes((first, decoded[2] << 4, decoded[3] & 0xFF, decoded[3] >> 8))
+    return bytes((first, 0, decoded[2] & 0xFF, decoded[2] >> 8))
+
+
+def decoded_text(decoded, labels:Optional[dict]=None) -> str:
+    # JASM text of an already decoded instruction (trace and profile entries,
+    # which must not re-read memory that may have changed since)
+    return instruction(decoded_bytes(decoded).ljust(4, b"\0"), 0, labels)[1]
+
+
+def disassemble(memory, start:int=0, end:int=MEM_SIZE, labels:Optional[dict]=None):
+    # linear sweep: (addr, size, text) for each instruction starting in [start, end)
+    addr = start
+    while addr < end:
+        size, text = instruction(memory, addr, labels)
+        yield addr, size, text
+        addr += size
+
+
+def listing(memory, start:int=0, end:int=MEM_SIZE, labels:Optional[dict]=None, out=None):
+    # write "ADDR  BYTES  TEXT" lines, with "label:" lines before labelled addresses
+    out = sys.stdout if out is None else out
+    lines = []
+    for addr, size, text in disassemble(memory, start, end, labels):
+        if labels and addr in labels:
+            lines.append(f"{labels[addr]}:")
+        raw = bytes(memory[(addr + i) & 0xFFFF] for i in range(size)).hex(" ")
+        lines.append(f"    {addr:04X}  {raw:<11}  {text}")
+    out.write("\n".join(lines) + "\n" if lines else "")
+
+
+# ---------------- main ----------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Disassemble a JOKOR binary")
+    parser.add_argument("file", help="Binary (or snapshot) to disassemble")
+    parser.add_argument("--base", type=lambda x: int(x, 16), default=0x0000, help="Load address (hex)")
+    parser.add_argument("--start", type=lambda x: int(x, 16), default=None, help="First address (hex)")
+    parser.add_argument("--end", type=lambda x: int(x, 16), default=None, help="Stop before this address (hex)")
+    parser.add_argument("-s", "--symbols", default=None, help="Symbol file from jasm -s for labels")
+    parser.add_argument("-o", "--output", default=None, help="Write the listing here instead of stdout")
+    args = parser.parse_args(argv)
+
+    memory = bytearray(MEM_SIZE)
+    with open(args.file, "rb") as fh:
+        data = fh.read(MEM_SIZE - args.base)
+    memory[args.base:args.base + len(data)] = data
+    start = args.base if args.start is None else args.start
+    end = args.base + len(data) if args.end is None else args.end
+    labels = label_map(SymbolTable.load(args.symbols) if args.symbols else None)
+
+    if args.output:
+        with open(args.output, "w") as out:
+            listing(memory, start, end, labels, out)
+    else:
+        listing(memory, start, end, labels)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
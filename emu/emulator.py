@@ -3,30 +3,79 @@
 JASM v1.1 emulator — full 32-op implementation (opcodes 0..31).
 Usage:
     python emulator.py [binary]
+    python emulator.py run <binary|--restore SNAPSHOT> [--max-instructions N] [--engine step|block]
+                                    [--banks N] [--bank-file PATH] [--protect-rom]
+                                    [--device KIND@PORT[:ARG][,irq=N] ...] [--no-idle-skip] [--cycles]
+                                    [--save-snapshot PATH] [--record LOG | --replay LOG]
+                                    [--trace N] [--trace-file PATH]
+                                    [--profile PATH] [--profile-collapsed PATH] [--symbols PATH]
+                                    [--cprofile [PATH]]
+                                    [--dump-regs] [--dump-mem HEXADDR:LEN ...]
 REPL commands:
-    load <path>, step, cont, run, break <hex>, regs, mem <hexaddr> <len>, disasm [hexaddr], ports, quit
+    load <path>, step, cont, run, engine [step|block], cycles [on|off], break <hex> [if <cond>], bclear,
+    watch <hex>[-<hex>] [r|w|rw], wclear, breaks, regs, mem <hexaddr> <len>, disasm [hexaddr] [n], snapshot <path>, restore <path>, trace on [size]|off|[n],
+    profile on|off|[n], symbols <path>, record <path>|stop, replay <path>|stop, ports, quit
 """
+import os
 import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import tempfile
+from array import array
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 from typing import Tuple, Optional
 
+from symbols import MEM_SIZE, SymbolTable
+
 # -----------------------
 # Constants / maps
 # -----------------------
-MEM_SIZE = 65536
 
 REG_CODE_TO_NAME = {
-    0x0: 'A', 0x1: 'B', 0x2: 'C', 0x3: 'D', 0x4: 'X', 0x5: 'Y'
+    0x0: 'A', 0x1: 'B', 0x2: 'C', 0x3: 'D', 0x4: 'X', 0x5: 'Y',
+    0x6: 'F', 0x7: 'Z', 0x8: 'PC', 0x9: 'SP', 0xA: 'MB', 0xB: 'STS'
 }
 REG_INDEX = ['A','B','C','D','X','Y']
 
+# register codes (4 bits); codes below REG_F are plain 8-bit registers
+REG_F   = 0x6
+REG_Z   = 0x7
+REG_PC  = 0x8
+REG_SP  = 0x9
+REG_MB  = 0xA
+REG_STS = 0xB
+
 # flags bits
 FLAG_C = 0
 FLAG_Z = 1
 FLAG_N = 2
 FLAG_V = 3
 
+# lazy flag sources for C/V (see flush_flags)
+LAZY_ADD = 0
+LAZY_SUB = 1
+LAZY_CMP = 2
+
 # status bits
-STS_HALT = 1 << 1
+STS_ERROR = 1 << 0
+STS_HALT  = 1 << 1
+STS_IE    = 1 << 2  # interrupts enabled
+
+# interrupts: INT n (and IRQ line n) jumps through the 16-bit little-endian
+# vector at IVT_BASE + 2n after pushing STS, F, PC high, PC low.
+# two INT numbers are reserved: WAIT idles until an interrupt arrives,
+# RETI pops the frame and restores PC, F and the interrupt enable bit
+IVT_BASE = 0x7E00
+INT_WAIT = 0xFE
+INT_RETI = 0xFF
+INT_SIZE = 3  # bytes in an INT instruction (MODE_IMM8_ONLY)
 
 # opcodes
 OP_LOAD  = 0
@@ -72,33 +121,663 @@ MODE_REG_ABS16   = 0b101  # 5
 MODE_REG_PAIR16  = 0b110  # 6
 MODE_ABS16_ONLY  = 0b111  # 7
 
+# names for reports, e.g. OP_NAMES[OP_JNZ] == "JNZ"
+OP_NAMES   = {v: k[3:] for k, v in dict(globals()).items() if k.startswith("OP_")}
+MODE_NAMES = {v: k[5:] for k, v in dict(globals()).items() if k.startswith("MODE_")}
+
+# block translation
+BLOCK_MAX_INSTRUCTIONS = 64
+BLOCK_TERMINATORS = {OP_JMP, OP_JZ, OP_JNZ, OP_JC, OP_JNC, OP_INT, OP_HALT}
+CONDITIONAL_JUMPS = {OP_JZ, OP_JNZ, OP_JC, OP_JNC}
+
+# opcodes an idle loop may contain (see CPU.skip_idle): nothing that writes
+# memory or ports, so one iteration only changes registers, flags and PC
+IDLE_LOOP_OPS = {
+    OP_MOVE, OP_ADD, OP_ADDC, OP_SUB, OP_SUBB, OP_INC, OP_DEC, OP_SHL, OP_SHR,
+    OP_AND, OP_OR, OP_NOR, OP_NOT, OP_XOR, OP_INB, OP_CMP, OP_SEC, OP_CLC, OP_CLZ,
+    OP_JMP, OP_JZ, OP_JNZ, OP_JC, OP_JNC, OP_NOP,
+}
+
+# flag bits written / read by each opcode, used for dead flag elimination
+# inside translated blocks (C=1, Z=2, N=4, V=8)
+FLAGS_ALL = 0b1111
+FLAGS_ZN  = (1 << FLAG_Z) | (1 << FLAG_N)
+FLAGS_CVZN = FLAGS_ALL
+FLAG_WRITES = {
+    OP_LOAD: FLAGS_ZN, OP_MOVE: FLAGS_ZN, OP_POP: FLAGS_ZN,
+    OP_ADD: FLAGS_CVZN, OP_ADDC: FLAGS_CVZN, OP_SUB: FLAGS_CVZN, OP_SUBB: FLAGS_CVZN,
+    OP_INC: FLAGS_ZN, OP_DEC: FLAGS_ZN, OP_SHL: FLAGS_ZN, OP_SHR: FLAGS_ZN,
+    OP_AND: FLAGS_ZN, OP_OR: FLAGS_ZN, OP_NOR: FLAGS_ZN, OP_NOT: FLAGS_ZN, OP_XOR: FLAGS_ZN,
+    OP_CMP: FLAGS_ZN | (1 << FLAG_C),
+    OP_SEC: 1 << FLAG_C, OP_CLC: 1 << FLAG_C, OP_CLZ: 1 << FLAG_Z,
+}
+FLAG_READS = {
+    OP_ADDC: 1 << FLAG_C, OP_SUBB: 1 << FLAG_C,
+    OP_JZ: 1 << FLAG_Z, OP_JNZ: 1 << FLAG_Z, OP_JC: 1 << FLAG_C, OP_JNC: 1 << FLAG_C,
+}
+
+# banked RAM: MB selects which 16 KiB bank is mapped at 0x8000..0xBFFF.
+# MB = 0 is the built-in RAM in the flat memory image
+BANK_BASE  = 0x8000
+BANK_SIZE  = 0x4000
+BANK_COUNT = 255
+
+# memory layout from the spec: (first, last, name, kind). the register
+# page at the top aliases F, Z, MB, SP and PC (16-bit values little-endian)
+REGION_ROM  = 'rom'
+REGION_RAM  = 'ram'
+REGION_MMIO = 'mmio'
+MEMORY_REGIONS = [
+    (0x0000, 0x7DFF, "ROM", REGION_ROM),
+    (0x7E00, 0x7FFF, "interrupt vectors", REGION_ROM),
+    (0x8000, 0xBFFF, "banked RAM", REGION_RAM),
+    (0xC000, 0xFBFF, "RAM", REGION_RAM),
+    (0xFC00, 0xFEFF, "stack", REGION_RAM),
+    (0xFF00, 0xFFF8, "scratch", REGION_RAM),
+    (0xFFF9, 0xFFFF, "register page", REGION_MMIO),
+]
+MMIO_BASE = 0xFFF9
+
+# write_map flags: a write to a flagged byte leaves the fast path
+WRITE_CODE = 1  # decoded code lives here (invalidate caches)
+WRITE_TRAP = 2  # protected ROM (raise)
+WRITE_MMIO = 4  # memory-mapped register
+WRITE_WATCH = 8  # write watchpoint
+
+# snapshot file: the 64 KiB memory image first (so it can be mapped
+# straight from offset 0), then a fixed trailer with the rest of the state,
+# then one (bank number, 16 KiB) record per allocated bank
+SNAPSHOT_MAGIC = b"JKSN"
+SNAPSHOT_VERSION = 2
+# magic, version, register file, PC, SP, halted, instructions retired, ports, banks
+SNAPSHOT_TRAILER = struct.Struct("<4sB16sHHBQ256sH")
+SNAPSHOT_BANK = struct.Struct("<B")
+
+# I/O log: header, then one fixed record per INB/OUTB:
+# kind, port, value, instructions retired before it
+IO_LOG_MAGIC = b"JKIO"
+IO_LOG_VERSION = 1
+IO_LOG_HEADER = struct.Struct("<4sB")
+IO_LOG_RECORD = struct.Struct("<BBBQ")
+IO_IN  = 0
+IO_OUT = 1
+
+# instructions between device polls (see CPU.attach)
+DEVICE_POLL_INTERVAL = 1024
+
+# timing model (see CPU.set_timing): an instruction takes one cycle per
+# byte fetched, plus MEMORY_CYCLES per data byte read or written and
+# IO_CYCLES per port access. bytes per addressing mode as in the assembler
+MODE_SIZE = {
+    MODE_NO_OPERANDS: 1, MODE_SINGLE_REG: 2, MODE_IMM8_ONLY: 3, MODE_REG_REG: 2,
+    MODE_REG_IMM8: 3, MODE_REG_ABS16: 4, MODE_REG_PAIR16: 3, MODE_ABS16_ONLY: 4,
+}
+MEMORY_CYCLES = 1
+IO_CYCLES = 2
+# taking an interrupt pushes STS, F and PC and reads the 16-bit vector;
+# RETI pops the four bytes again
+INTERRUPT_CYCLES = 6 * MEMORY_CYCLES
+RETI_CYCLES = 4 * MEMORY_CYCLES
+
+# functions listed by the batch runner's --cprofile summary
+CPROFILE_TOP = 25
+
+# trace entries the REPL shows when a command fails while tracing
+TRACE_DUMP_ON_ERROR = 16
+
 def mask8(x): return x & 0xFF
 def mask16(x): return x & 0xFFFF
 
+def region_at(addr:int) -> str:
+    for start, end, name, _ in MEMORY_REGIONS:
+        if start <= addr <= end:
+            return name
+    return "memory"
+
+def instruction_cycles(opcode:int, mode:int) -> int:
+    cycles = MODE_SIZE[mode]
+    if opcode in (OP_LOAD, OP_STORE) and mode in (MODE_REG_ABS16, MODE_REG_PAIR16):
+        cycles += MEMORY_CYCLES
+    elif opcode in (OP_PUSH, OP_POP):
+        cycles += MEMORY_CYCLES
+    elif opcode in (OP_INB, OP_OUTB):
+        cycles += IO_CYCLES
+    return cycles
+
+# cycles by [opcode][mode]; interrupt entry and RETI are charged on top
+CYCLE_TABLE = [[instruction_cycles(op, mode) for mode in range(8)] for op in range(32)]
+
+# -----------------------
+# Snapshots
+# -----------------------
+class Snapshot:
+    # frozen machine state. memory is read-only (bytes, or a read-only map
+    # of a snapshot file); CPU.restore maps it copy-on-write so forking many
+    # CPUs from one snapshot only copies the pages each of them writes to
+    def __init__(self, memory, regs:bytes, PC:int, SP:int, ports:bytes, halted:bool, icount:int,
+                 banks:Optional[dict]=None, fd:Optional[int]=None):
+        self.memory = memory
+        # bank number -> 16 KiB contents, for the banks that were allocated
+        self.banks = {} if banks is None else banks
+        self.regs = regs
+        self.PC = PC
+        self.SP = SP
+        self.ports = ports
+        self.halted = halted
+        self.icount = icount
+        # file holding the memory image at offset 0; created on first
+        # restore for snapshots that were never saved or loaded
+        self._fd = fd
+
+    def save(self, path:str):
+        trailer = SNAPSHOT_TRAILER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.regs, self.PC, self.SP,
+                                        self.halted, self.icount, self.ports, len(self.banks))
+        with open(path, "wb") as fh:
+            fh.write(self.memory)
+            fh.write(trailer)
+            for n, data in sorted(self.banks.items()):
+                fh.write(SNAPSHOT_BANK.pack(n))
+                fh.write(data)
+
+    @classmethod
+    def load(cls, path:str) -> "Snapshot":
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            size = os.fstat(fd).st_size
+            if size < MEM_SIZE + SNAPSHOT_TRAILER.size:
+                raise ValueError(f"{path}: not a snapshot (bad size)")
+            banks = {}
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as image:
+                magic, version, regs, pc, sp, halted, icount, ports, nbanks = SNAPSHOT_TRAILER.unpack_from(image, MEM_SIZE)
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                    raise ValueError(f"{path}: not a snapshot (bad magic or version)")
+                record = SNAPSHOT_BANK.size + BANK_SIZE
+                offset = MEM_SIZE + SNAPSHOT_TRAILER.size
+                if size != offset + nbanks * record:
+                    raise ValueError(f"{path}: not a snapshot (bad size)")
+                for _ in range(nbanks):
+                    (n,) = SNAPSHOT_BANK.unpack_from(image, offset)
+                    banks[n] = image[offset + SNAPSHOT_BANK.size:offset + record]
+                    offset += record
+            memory = mmap.mmap(fd, MEM_SIZE, access=mmap.ACCESS_READ)
+        except Exception:
+            os.close(fd)
+            raise
+        return cls(memory, regs, pc, sp, ports, bool(halted), icount, banks, fd)
+
+    def mapping(self) -> mmap.mmap:
+        # a private copy-on-write view of the memory image: pages stay
+        # shared with the snapshot until written
+        if self._fd is None:
+            with tempfile.TemporaryFile() as fh:
+                fh.write(self.memory)
+                fh.flush()
+                self._fd = os.dup(fh.fileno())
+        return mmap.mmap(self._fd, MEM_SIZE, access=mmap.ACCESS_COPY)
+
+    def __del__(self):
+        if self._fd is not None:
+            os.close(self._fd)
+
+# -----------------------
+# Memory banks
+# -----------------------
+class BankStore:
+    # 16 KiB banks for MB = 1..count. Banks live in their own bytearrays,
+    # allocated on first use, or in one memory-mapped file (bank n at
+    # offset (n - 1) * BANK_SIZE) so large images don't have to sit in RAM
+    def __init__(self, count:int=BANK_COUNT, path:Optional[str]=None):
+        if not 1 <= count <= BANK_COUNT:
+            raise ValueError(f"bank count must be 1..{BANK_COUNT}")
+        self.count = count
+        self.banks = {}
+        self.map = None
+        if path is not None:
+            with open(path, "a+b") as fh:
+                if os.fstat(fh.fileno()).st_size < count * BANK_SIZE:
+                    fh.truncate(count * BANK_SIZE)
+                self.map = mmap.mmap(fh.fileno(), count * BANK_SIZE)
+
+    def bank(self, n:int):
+        buf = self.banks.get(n)
+        if buf is None:
+            if not 1 <= n <= self.count:
+                raise RuntimeError(f"MB=0x{n:02X} selects a missing memory bank (banks 1..{self.count})")
+            if self.map is not None:
+                buf = memoryview(self.map)[(n - 1) * BANK_SIZE:n * BANK_SIZE]
+            else:
+                buf = bytearray(BANK_SIZE)
+            self.banks[n] = buf
+        return buf
+
+    def contents(self) -> dict:
+        # bank number -> bytes for every bank in use (all of them when file-backed)
+        if self.map is not None:
+            return {n: bytes(self.bank(n)) for n in range(1, self.count + 1)}
+        return {n: bytes(buf) for n, buf in self.banks.items()}
+
+    def load(self, contents:dict):
+        # replace every bank's contents (banks not in contents become zero)
+        if self.map is None:
+            self.banks = {n: bytearray(data) for n, data in contents.items()}
+            return
+        for n in range(1, self.count + 1):
+            self.bank(n)[:] = contents.get(n, bytes(BANK_SIZE))
+
+    def flush(self):
+        if self.map is not None:
+            self.map.flush()
+
+
+class BankedMemory:
+    # the CPU's view of memory while a bank other than 0 is mapped: the
+    # flat image outside the window, the selected bank inside it. Switching
+    # banks only swaps the window buffer
+    def __init__(self, ram):
+        view = memoryview(ram)
+        self.pages = [view[0x0000:0x4000], view[0x4000:BANK_BASE], None, view[BANK_BASE + BANK_SIZE:]]
+
+    def __getitem__(self, addr):
+        try:
+            return self.pages[addr >> 14][addr & 0x3FFF]
+        except TypeError:
+            return bytes(self)[addr]
+
+    def __setitem__(self, addr, value):
+        try:
+            self.pages[addr >> 14][addr & 0x3FFF] = value
+        except TypeError:
+            for a, v in zip(range(*addr.indices(MEM_SIZE)), value):
+                self.pages[a >> 14][a & 0x3FFF] = v
+
+    def __len__(self) -> int:
+        return MEM_SIZE
+
+    def __bytes__(self) -> bytes:
+        return b"".join(bytes(page) for page in self.pages)
+
+# -----------------------
+# I/O record / replay
+# -----------------------
+class IORecorder:
+    # logs every INB result and OUTB write, streaming to the file
+    def __init__(self, path:str):
+        self.fh = open(path, "wb")
+        self.fh.write(IO_LOG_HEADER.pack(IO_LOG_MAGIC, IO_LOG_VERSION))
+        self.records = 0
+
+    def port_in(self, cpu, port:int) -> int:
+        val = cpu.port_read(port)
+        self.fh.write(IO_LOG_RECORD.pack(IO_IN, port, val, cpu.icount))
+        self.records += 1
+        return val
+
+    def port_out(self, cpu, port:int, val:int):
+        cpu.port_write(port, val)
+        self.fh.write(IO_LOG_RECORD.pack(IO_OUT, port, val, cpu.icount))
+        self.records += 1
+
+    def close(self):
+        self.fh.close()
+
+
+class IOReplayer:
+    # feeds INB from a recorded log and checks every OUTB against it;
+    # raises RuntimeError at the first instruction that diverges
+    def __init__(self, path:str):
+        self.fh = open(path, "rb")
+        header = self.fh.read(IO_LOG_HEADER.size)
+        if len(header) != IO_LOG_HEADER.size or IO_LOG_HEADER.unpack(header) != (IO_LOG_MAGIC, IO_LOG_VERSION):
+            self.fh.close()
+            raise ValueError(f"{path}: not an I/O log")
+        self.records = 0
+        self._next = self._read()
+
+    def _read(self):
+        data = self.fh.read(IO_LOG_RECORD.size)
+        return IO_LOG_RECORD.unpack(data) if len(data) == IO_LOG_RECORD.size else None
+
+    def _expect(self, cpu, kind:int, port:int):
+        name = ("INB", "OUTB")[kind]
+        rec = self._next
+        if rec is None:
+            raise RuntimeError(f"replay: {name} port 0x{port:02X} at instruction {cpu.icount} is past the end of the log")
+        r_kind, r_port, r_val, r_icount = rec
+        if (r_kind, r_port, r_icount) != (kind, port, cpu.icount):
+            raise RuntimeError(f"replay: {name} port 0x{port:02X} at instruction {cpu.icount}, "
+                               f"log has {('INB', 'OUTB')[r_kind]} port 0x{r_port:02X} at instruction {r_icount}")
+        self.records += 1
+        self._next = self._read()
+        return r_val
+
+    def port_in(self, cpu, port:int) -> int:
+        val = self._expect(cpu, IO_IN, port)
+        cpu.ports[port] = val
+        return val
+
+    def port_out(self, cpu, port:int, val:int):
+        logged = self._expect(cpu, IO_OUT, port)
+        if val != logged:
+            raise RuntimeError(f"replay: OUTB port 0x{port:02X} wrote 0x{val:02X} at instruction {cpu.icount}, log has 0x{logged:02X}")
+        cpu.ports[port] = val
+
+    def finished(self) -> bool:
+        return self._next is None
+
+    def close(self):
+        self.fh.close()
+
+
+# -----------------------
+# Tracing
+# -----------------------
+class Tracer:
+    # the last `size` executed instructions in preallocated ring buffers.
+    # each entry is taken before the instruction runs, so a faulting
+    # instruction is the newest entry; flags are F as the instruction saw it.
+    # decoded instructions are shared with the decode cache, not copied
+    def __init__(self, size:int=8192):
+        if size <= 0:
+            raise ValueError("trace size must be positive")
+        self.size = size
+        self.icount = array('Q', bytes(8 * size))
+        self.pc = array('H', bytes(2 * size))
+        self.decoded = [None] * size
+        self.flags = array('B', bytes(size))
+        # next slot to write and entries recorded so far
+        self.pos = 0
+        self.count = 0
+
+    def record(self, cpu, pc:int, decoded):
+        i = self.pos
+        self.icount[i] = cpu.icount
+        self.pc[i] = pc
+        self.decoded[i] = decoded
+        self.flags[i] = cpu.flush_flags()
+        i += 1
+        self.pos = 0 if i == self.size else i
+        self.count += 1
+
+    def clear(self):
+        self.pos = 0
+        self.count = 0
+
+    def entries(self, last:Optional[int]=None):
+        # (icount, pc, opcode, mode, op1, op2, flags), oldest first
+        n = min(self.count, self.size)
+        if last is not None:
+            n = min(n, last)
+        for k in range(self.pos - n, self.pos):
+            i = k % self.size
+            decoded = self.decoded[i]
+            operands = decoded[2:] + (0, 0)
+            yield (self.icount[i], self.pc[i], decoded[0], decoded[1],
+                   operands[0], operands[1], self.flags[i])
+
+    def dump(self, out=None, last:Optional[int]=None):
+        # one line per entry, the instruction as disasm.py writes it
+        from disasm import decoded_text
+        out = sys.stdout if out is None else out
+        for icount, pc, opcode, mode, op1, op2, flags in self.entries(last):
+            text = decoded_text((opcode, mode, op1, op2))
+            out.write(f"{icount:>10} 0x{pc:04X}: {text:<20} F=0x{flags:02X}\n")
+
+
+# -----------------------
+# Breakpoints
+# -----------------------
+class Breakpoint:
+    # stops step() before the instruction at addr if condition (a Python
+    # expression over the register names and mem(addr), e.g. "A == 0x37")
+    # is true or not given. hits counts those stops
+    def __init__(self, addr:int, condition:Optional[str]=None):
+        self.addr = addr & 0xFFFF
+        self.condition = condition
+        self.code = None if condition is None else compile(condition, f"<break 0x{self.addr:04X}>", "eval")
+        self.hits = 0
+
+    def check(self, cpu) -> bool:
+        if self.code is not None:
+            names = cpu.register_values()
+            names['mem'] = cpu.read_u8
+            if not eval(self.code, {"__builtins__": {}}, names):
+                return False
+        self.hits += 1
+        return True
+
+    def __str__(self):
+        cond = f" if {self.condition}" if self.condition else ""
+        return f"break 0x{self.addr:04X}{cond} (hits {self.hits})"
+
+
+class Watchpoint:
+    # stops step() after an instruction that reads ('r'), writes ('w') or
+    # either ('rw') a byte in [start, end]. reads are LOAD [imm16] and POP
+    def __init__(self, start:int, end:int, access:str='w'):
+        if access not in ('r', 'w', 'rw'):
+            raise ValueError("watchpoint access must be r, w or rw")
+        self.start = start & 0xFFFF
+        self.end = end & 0xFFFF
+        if self.end < self.start:
+            raise ValueError("watchpoint range ends before it starts")
+        self.access = access
+        self.hits = 0
+
+    def __str__(self):
+        span = f"0x{self.start:04X}" if self.start == self.end else f"0x{self.start:04X}-0x{self.end:04X}"
+        return f"watch {span} {self.access} (hits {self.hits})"
+
+
+# -----------------------
+# Profiling
+# -----------------------
+class Profiler:
+    # execution counts per PC, opcode and addressing mode, block entries and
+    # taken / not-taken counts of conditional jumps. Whole blocks are logged
+    # as (block, instructions run, exit PC) and only expanded into the
+    # per-instruction counts when a report is made, so the cost while
+    # running is one dict update per block
+    def __init__(self):
+        self.pc_counts = array('Q', bytes(8 * MEM_SIZE))
+        self.opcode_counts = array('Q', bytes(8 * 32))
+        self.mode_counts = array('Q', bytes(8 * 8))
+        self.block_entries = array('Q', bytes(8 * MEM_SIZE))
+        # pc -> [taken, not taken]
+        self.branches = {}
+        # pc -> the decoded instruction last executed there
+        self.decoded = {}
+        # (id(block), instructions run, exit pc) -> times, and id -> block
+        # (held so the id stays unique until folded)
+        self.runs = {}
+        self.blocks = {}
+        # whether the next single-stepped instruction starts a block
+        self._entry = True
+
+    def instruction(self, pc:int, decoded, next_pc:int, exit_pc:int):
+        opcode = decoded[0]
+        self.pc_counts[pc] += 1
+        self.opcode_counts[opcode] += 1
+        self.mode_counts[decoded[1]] += 1
+        self.decoded[pc] = decoded
+        if self._entry:
+            self.block_entries[pc] += 1
+        if opcode in CONDITIONAL_JUMPS:
+            self._branch(pc, exit_pc != next_pc, 1)
+        self._entry = opcode in BLOCK_TERMINATORS
+
+    def block(self, block, n:int, exit_pc:int):
+        k = id(block)
+        if k not in self.blocks:
+            self.blocks[k] = block
+        key = (k, n, exit_pc)
+        runs = self.runs
+        runs[key] = runs.get(key, 0) + 1
+        self._entry = True
+
+    def _branch(self, pc:int, taken:bool, times:int):
+        counts = self.branches.get(pc)
+        if counts is None:
+            counts = self.branches[pc] = [0, 0]
+        counts[0 if taken else 1] += times
+
+    def fold(self):
+        # expand the logged block runs into the per-instruction counts
+        for (k, n, exit_pc), times in self.runs.items():
+            block = self.blocks[k]
+            instrs = block[4]
+            self.block_entries[block[1]] += times
+            for pc, decoded, _ in instrs[:n]:
+                self.pc_counts[pc] += times
+                self.opcode_counts[decoded[0]] += times
+                self.mode_counts[decoded[1]] += times
+                self.decoded[pc] = decoded
+            pc, decoded, next_pc = instrs[-1]
+            if n == block[3] and decoded[0] in CONDITIONAL_JUMPS:
+                self._branch(pc, exit_pc != next_pc, times)
+        self.runs.clear()
+        self.blocks.clear()
+
+    @staticmethod
+    def _describe(decoded) -> str:
+        from disasm import decoded_text
+        return decoded_text(decoded)
+
+    def report(self, out=None, symbols:Optional[SymbolTable]=None, top:int=20):
+        self.fold()
+        out = sys.stdout if out is None else out
+        name = symbols.format if symbols is not None else (lambda addr: f"0x{addr:04X}")
+        total = sum(self.pc_counts)
+        pct = lambda n: 100.0 * n / total if total else 0.0
+        hot = sorted((pc for pc in self.decoded if self.pc_counts[pc]), key=lambda pc: -self.pc_counts[pc])
+        out.write(f"profile: {total} instructions at {len(hot)} addresses\n")
+
+        out.write(f"\nhot instructions (top {top}):\n")
+        for pc in hot[:top]:
+            n = self.pc_counts[pc]
+            out.write(f"  {n:>12} {pct(n):6.2f}%  0x{pc:04X} {name(pc):<20} {self._describe(self.decoded[pc])}\n")
+
+        out.write("\nopcodes:\n")
+        for op in sorted(range(32), key=lambda op: -self.opcode_counts[op]):
+            n = self.opcode_counts[op]
+            if n:
+                out.write(f"  {n:>12} {pct(n):6.2f}%  {OP_NAMES[op]}\n")
+
+        out.write("\naddressing modes:\n")
+        for mode in sorted(range(8), key=lambda mode: -self.mode_counts[mode]):
+            n = self.mode_counts[mode]
+            if n:
+                out.write(f"  {n:>12} {pct(n):6.2f}%  {MODE_NAMES[mode]}\n")
+
+        out.write(f"\nblock entries (top {top}):\n")
+        entries = sorted((pc for pc in range(MEM_SIZE) if self.block_entries[pc]), key=lambda pc: -self.block_entries[pc])
+        for pc in entries[:top]:
+            out.write(f"  {self.block_entries[pc]:>12}  0x{pc:04X} {name(pc)}\n")
+
+        out.write("\nconditional branches:\n")
+        for pc, (taken, not_taken) in sorted(self.branches.items(), key=lambda item: -sum(item[1])):
+            op = OP_NAMES[self.decoded[pc][0]] if pc in self.decoded else "?"
+            out.write(f"  0x{pc:04X} {name(pc):<20} {op:<4} taken {taken:>10}  not taken {not_taken:>10}"
+                      f"  ({100.0 * taken / (taken + not_taken):5.1f}% taken)\n")
+
+    def collapsed(self, out, symbols:Optional[SymbolTable]=None):
+        # flamegraph.pl / speedscope "collapsed stack" lines: label;label+off count
+        self.fold()
+        for pc in sorted(self.decoded):
+            n = self.pc_counts[pc]
+            if not n:
+                continue
+            found = symbols.lookup(pc) if symbols is not None else None
+            frame = found[0] if found is not None else "[unknown]"
+            leaf = symbols.format(pc) if found is not None else f"0x{pc:04X}"
+            out.write(f"{frame};{leaf} {n}\n")
+
+
 # -----------------------
 # CPU
 # -----------------------
 class CPU:
-    def __init__(self):
-        # GPRs 8-bit
-        self.reg = {name:0 for name in REG_INDEX}  # A,B,C,D,X,Y
-        # special
+    # optional hooks and rarely changed settings are class-level defaults,
+    # only stored on the instance when set: CPython keeps attribute access
+    # fast only while an instance has at most 30 attributes
+    # IORecorder / IOReplayer that INB and OUTB go through, if any
+    io_log = None
+    # Tracer recording every executed instruction, if any
+    tracer = None
+    # Profiler counting executions, if any
+    profiler = None
+    # instructions between device polls
+    poll_interval = DEVICE_POLL_INTERVAL
+    # trap ROM writes (see set_rom_protection)
+    protect_rom = False
+    # spinning on INT WAIT
+    waiting = False
+    # skip over idle loops at device polls (see skip_idle)
+    idle_skip = True
+    # instructions skipped that way so far
+    idle_skipped = 0
+    # count cycles by the timing model (see set_timing)
+    timing = False
+    # cycles elapsed so far, while timing
+    cycles = 0
+    # Watchpoints, and per-byte read flags while any of them watch reads
+    # (writes are flagged in write_map)
+    watchpoints = ()
+    read_watch = None
+    # why step() should stop after the current instruction (a watchpoint)
+    watch_stop = None
+
+    def __init__(self, verbose:bool=True):
+        # verbose: print load/halt/INT messages (the batch runner turns this off)
+        self.verbose = verbose
+        # register file indexed by register code: A-Y, F, Z, MB, STS.
+        # PC and SP are 16 bits wide and live in their own attributes;
+        # 8-bit instructions see their low byte (codes 8 and 9)
+        self.regs = bytearray(16)
         self.PC = 0x0000
         self.SP = 0xFEFF
-        self.F  = 0x00    # flags byte
-        self.STS = 0x00
-        self.Z   = 0x00
-        self.MB  = 0x00
-        # mem and I/O
-        self.memory = bytearray(MEM_SIZE)
+        # lazy flags: the last result byte that Z/N derive from and the
+        # (kind, a, b) of the last operation that set C/V, or None once
+        # folded into F
+        self._zn = None
+        self._cv = None
+        # mem and I/O. ram is the flat image (with bank 0 in the window);
+        # memory is what instructions see: ram itself while MB = 0, a
+        # BankedMemory view over it and the selected bank otherwise
+        self.ram = bytearray(MEM_SIZE)
+        self.memory = self.ram
+        self.banks = BankStore()
+        self._banked = None
+        # set when cached code overlaps the bank window
+        self.window_code = False
         self.ports = [0]*256
-        # breakpoints
-        self.breakpoints = set()
+        # IRQ lines raised but not yet taken, as a bit mask (bit n = line n)
+        self.irq_pending = 0
+        # devices on the port bus: port -> device, and polling state
+        self.devices = []
+        self.port_devices = [None]*256
+        self.next_poll = 0
+        # breakpoints: address -> Breakpoint
+        self.breakpoints = {}
         # handlers map
         self.handlers = {}
         self._build_handlers()
+        # decode cache: pc -> (handler, decoded, next_pc)
+        self.decode_cache = {}
+        # per-byte WRITE_* flags: writes to a flagged byte take the slow path
+        # (code invalidation, register aliases, ROM traps); plain RAM pays
+        # only the flag test
+        self.write_map = self._base_write_map()
+        # bumped whenever cached code is invalidated
+        self.code_epoch = 0
+        # translated blocks: pc -> (function, start, end, instruction count,
+        # ((pc, decoded, next_pc), ...) for each instruction, cycles of the
+        # first n instructions for each n)
+        self.block_cache = {}
+        self.engine = 'step'
         # halted state
         self.halted = False
+        # instructions retired so far
+        self.icount = 0
 
     # ---------------- memory helpers ----------------
     def load_program(self, data: bytes, base: int=0x0000):
@@ -106,14 +785,92 @@ class CPU:
         if base + n > MEM_SIZE:
             raise ValueError("Program too large")
         self.memory[base:base+n] = data
+        self.invalidate_code(base, base + n)
         self.PC = base
-        print(f"Loaded {n} bytes at 0x{base:04X}")
+        if self.verbose:
+            print(f"Loaded {n} bytes at 0x{base:04X}")
 
     def read_u8(self, addr:int) -> int:
-        return self.memory[mask16(addr)]
+        addr &= 0xFFFF
+        if addr >= MMIO_BASE:
+            return self.mmio_read(addr)
+        return self.memory[addr]
 
     def write_u8(self, addr:int, val:int):
-        self.memory[mask16(addr)] = mask8(val)
+        addr &= 0xFFFF
+        if self.write_map[addr]:
+            self.special_write(addr, val & 0xFF)
+        else:
+            self.memory[addr] = val & 0xFF
+
+    def special_write(self, addr:int, val:int):
+        flags = self.write_map[addr]
+        if flags & WRITE_WATCH:
+            self.watch_hit(addr, 'w')
+        if flags & WRITE_MMIO:
+            self.mmio_write(addr, val)
+            return
+        if flags & WRITE_TRAP:
+            raise RuntimeError(f"write of 0x{val:02X} to {region_at(addr)} at 0x{addr:04X}")
+        self.memory[addr] = val
+        if flags & WRITE_CODE:
+            self.invalidate_code(addr, addr + 1)
+
+    # ---------------- memory-mapped registers ----------------
+    def _base_write_map(self) -> bytearray:
+        wmap = bytearray(MEM_SIZE)
+        for start, end, _, kind in MEMORY_REGIONS:
+            if kind == REGION_MMIO:
+                wmap[start:end + 1] = bytes([WRITE_MMIO]) * (end + 1 - start)
+            elif kind == REGION_ROM and self.protect_rom:
+                wmap[start:end + 1] = bytes([WRITE_TRAP]) * (end + 1 - start)
+        self._mark_watches(wmap, True)
+        return wmap
+
+    def set_rom_protection(self, enabled:bool):
+        # trap writes to the ROM region (load_program still fills it)
+        self.protect_rom = enabled
+        for start, end, _, kind in MEMORY_REGIONS:
+            if kind == REGION_ROM:
+                for addr in range(start, end + 1):
+                    if enabled:
+                        self.write_map[addr] |= WRITE_TRAP
+                    else:
+                        self.write_map[addr] &= ~WRITE_TRAP
+
+    def mmio_read(self, addr:int) -> int:
+        match addr:
+            case 0xFFF9: return self.flush_flags()
+            case 0xFFFA: return 0
+            case 0xFFFB: return self.regs[REG_MB]
+            case 0xFFFC: return self.SP & 0xFF
+            case 0xFFFD: return self.SP >> 8
+            case 0xFFFE: return self.PC & 0xFF
+            case 0xFFFF: return self.PC >> 8
+        return self.memory[addr]
+
+    def mmio_write(self, addr:int, val:int):
+        match addr:
+            case 0xFFF9:
+                self._zn = self._cv = None
+                self.regs[REG_F] = val
+            case 0xFFFA:
+                pass
+            case 0xFFFB:
+                self.select_bank(val)
+            case 0xFFFC:
+                self.SP = (self.SP & 0xFF00) | val
+            case 0xFFFD:
+                self.SP = (val << 8) | (self.SP & 0xFF)
+            case 0xFFFE | 0xFFFF:
+                if addr == 0xFFFE:
+                    self.PC = (self.PC & 0xFF00) | val
+                else:
+                    self.PC = (val << 8) | (self.PC & 0xFF)
+                # a jump: running blocks stop after handler fallbacks that bump the epoch
+                self.code_epoch += 1
+            case _:
+                self.memory[addr] = val
 
     def read_u16(self, addr:int) -> int:
         lo = self.read_u8(addr)
@@ -126,7 +883,9 @@ class CPU:
 
     # ---------------- fetch / decode ----------------
     def fetch_byte(self) -> int:
-        b = self.read_u8(self.PC)
+        # instruction fetch sees plain memory; the register page only
+        # aliases data accesses
+        b = self.memory[self.PC]
         self.PC = mask16(self.PC + 1)
         return b
 
@@ -186,31 +945,187 @@ class CPU:
             case _:
                 raise RuntimeError(f"Invalid mode {mode} at 0x{self.PC:04X}")
 
+    # ---------------- decode cache ----------------
+    def cache_decode(self, pc:int):
+        # decode the instruction at pc once and remember it with its handler
+        self.PC = pc
+        decoded = self.decode()
+        handler = self.handlers.get(decoded[0])
+        if handler is None:
+            raise RuntimeError(f"Unknown opcode 0x{decoded[0]:02X} at 0x{pc:04X}")
+        if decoded[0] == OP_LOAD and decoded[1] == MODE_REG_ABS16 and decoded[3] >= MMIO_BASE:
+            handler = self.handle_load_mmio
+        if self.read_watch is not None and (decoded[0] == OP_POP or
+                                            (decoded[0] == OP_LOAD and decoded[1] == MODE_REG_ABS16)):
+            handler = self.handle_watched_read
+        entry = (handler, decoded, self.PC)
+        self.decode_cache[pc] = entry
+        size = (self.PC - pc) & 0xFFFF
+        for i in range(size):
+            self.write_map[(pc + i) & 0xFFFF] |= WRITE_CODE
+        if pc < BANK_BASE + BANK_SIZE and pc + size > BANK_BASE:
+            self.window_code = True
+        return entry
+
+    def invalidate_code(self, start:int, end:int):
+        # drop cached instructions overlapping [start, end)
+        cache = self.decode_cache
+        if not cache:
+            return
+        if end - start <= 4:
+            # small write: only instructions starting up to 3 bytes before can overlap
+            stale = []
+            for pc in range(start - 3, end):
+                pc &= 0xFFFF
+                entry = cache.get(pc)
+                if entry is None:
+                    continue
+                size = (entry[2] - pc) & 0xFFFF
+                if any(start <= (pc + i) & 0xFFFF < end for i in range(size)):
+                    stale.append(pc)
+        else:
+            stale = [pc for pc, entry in cache.items()
+                     if any(start <= (pc + i) & 0xFFFF < end
+                            for i in range((entry[2] - pc) & 0xFFFF))]
+        for pc in stale:
+            del cache[pc]
+        if stale:
+            self.code_epoch += 1
+        if stale and self.block_cache:
+            self.invalidate_blocks(start, end)
+
     # ---------------- reg helpers ----------------
     def reg_get(self, code:int) -> int:
-        name = REG_CODE_TO_NAME.get(code)
-        if name is None: return 0
-        return self.reg[name] & 0xFF
+        if code < REG_F:
+            return self.regs[code]
+        return self.special_reg_get(code)
 
     def reg_set(self, code:int, value:int):
-        name = REG_CODE_TO_NAME.get(code)
-        if name is None: return
-        self.reg[name] = mask8(value)
+        if code < REG_F:
+            self.regs[code] = value & 0xFF
+        else:
+            self.special_reg_set(code, value)
+
+    def special_reg_get(self, code:int) -> int:
+        match code:
+            case 0x8:  # PC
+                return self.PC & 0xFF
+            case 0x9:  # SP
+                return self.SP & 0xFF
+            case 0x6:  # F
+                return self.flush_flags()
+            case 0xA | 0xB:  # MB, STS
+                return self.regs[code]
+            case _:  # Z reads as zero, 0xC-0xF are unassigned
+                return 0
+
+    def special_reg_set(self, code:int, value:int):
+        match code:
+            case 0x9:  # SP: 8-bit writes replace the low byte
+                self.SP = (self.SP & 0xFF00) | (value & 0xFF)
+            case 0x6:  # F: an explicit write replaces any pending flags
+                self._zn = self._cv = None
+                self.regs[code] = value & 0xFF
+            case 0xA:  # MB
+                self.select_bank(value & 0xFF)
+            case 0xB:  # STS
+                self.regs[code] = value & 0xFF
+                if self.irq_pending and value & STS_IE:
+                    self.check_interrupts()
+            case _:  # PC is read-only, Z discards writes
+                pass
+
+    @property
+    def F(self) -> int:
+        return self.flush_flags()
+
+    @F.setter
+    def F(self, value:int):
+        self._zn = self._cv = None
+        self.regs[REG_F] = value & 0xFF
+
+    @property
+    def Z(self) -> int:
+        return 0
+
+    @property
+    def MB(self) -> int:
+        return self.regs[REG_MB]
+
+    @MB.setter
+    def MB(self, value:int):
+        self.select_bank(value & 0xFF)
+
+    # ---------------- banking ----------------
+    def select_bank(self, n:int):
+        # map bank n at 0x8000..0xBFFF; O(1), nothing is copied
+        if n == 0:
+            self.memory = self.ram
+        else:
+            bank = self.banks.bank(n)
+            if self._banked is None:
+                self._banked = BankedMemory(self.ram)
+            self._banked.pages[2] = bank
+            self.memory = self._banked
+        self.regs[REG_MB] = n
+        if self.window_code:
+            self.window_code = False
+            self.invalidate_code(BANK_BASE, BANK_BASE + BANK_SIZE)
+        # translated blocks keep cpu.memory in a local; make them re-enter
+        self.code_epoch += 1
+
+    @property
+    def STS(self) -> int:
+        return self.regs[REG_STS]
+
+    @STS.setter
+    def STS(self, value:int):
+        self.regs[REG_STS] = value & 0xFF
 
     # ---------------- flags helpers ----------------
+    # ALU handlers only record what the flags derive from; F is computed
+    # when something actually looks at it.
+    def flush_flags(self) -> int:
+        f = self.regs[REG_F]
+        zn = self._zn
+        if zn is not None:
+            f = (f & ~((1<<FLAG_Z) | (1<<FLAG_N))) | ((zn == 0) << FLAG_Z) | ((zn >> 7) << FLAG_N)
+            self._zn = None
+        cv = self._cv
+        if cv is not None:
+            kind, a, b = cv
+            if kind == LAZY_CMP:
+                f = (f & ~(1<<FLAG_C)) | ((a < b) << FLAG_C)
+            else:
+                if kind == LAZY_ADD:
+                    _, carry, v = self._add_core(a, b)
+                else:
+                    _, carry, v = self._sub_core(a, b)
+                f = (f & ~((1<<FLAG_C) | (1<<FLAG_V))) | (carry << FLAG_C) | (v << FLAG_V)
+            self._cv = None
+        self.regs[REG_F] = f
+        return f
+
     def set_flag(self, bit:int, v:bool):
+        f = self.flush_flags()
         if v:
-            self.F |= (1<<bit)
+            self.regs[REG_F] = f | (1<<bit)
         else:
-            self.F &= ~(1<<bit)
+            self.regs[REG_F] = f & ~(1<<bit)
 
     def get_flag(self, bit:int) -> int:
-        return 1 if ((self.F >> bit) & 1) else 0
+        # Z and C are answered from the pending state without a full flush
+        if bit == FLAG_Z and self._zn is not None:
+            return 1 if self._zn == 0 else 0
+        if bit == FLAG_C and self._cv is not None:
+            kind, a, b = self._cv
+            if kind == LAZY_ADD:
+                return 1 if a + b > 0xFF else 0
+            return 1 if a < b else 0
+        return (self.flush_flags() >> bit) & 1
 
     def update_ZN_from8(self, value:int):
-        v = mask8(value)
-        self.set_flag(FLAG_Z, v == 0)
-        self.set_flag(FLAG_N, (v & 0x80) != 0)
+        self._zn = value & 0xFF
 
     # ---------------- stack ----------------
     def push8(self, val:int):
@@ -278,10 +1193,12 @@ class CPU:
         _, mode, *rest = decoded
         match mode:
             case 0b101:  # MODE_REG_ABS16
+                # addresses in the register page are sent to
+                # handle_load_mmio when the instruction is decoded
                 _, _, reg_d, addr = decoded
-                val = self.read_u8(addr)
-                self.reg_set(reg_d, val)
+                val = self.memory[addr]
                 self.update_ZN_from8(val)
+                self.reg_set(reg_d, val)
             case 0b110:  # MODE_REG_PAIR16
                 _, _, reg_s, reg_pair = decoded
                 # the high four bits of the register pair are the low register
@@ -294,6 +1211,25 @@ class CPU:
             case _:
                 raise RuntimeError("LOAD requires MODE_REG_ABS16 or MODE_REG_PAIR16")
 
+    def handle_load_mmio(self, decoded):
+        # LOAD reg, [imm16] from a memory-mapped register
+        _, _, reg_d, addr = decoded
+        val = self.mmio_read(addr)
+        self.update_ZN_from8(val)
+        self.reg_set(reg_d, val)
+
+    def handle_watched_read(self, decoded):
+        # LOAD reg, [imm16] and POP while read watchpoints are set
+        addr = decoded[3] if decoded[0] == OP_LOAD else self.SP
+        if self.read_watch[addr]:
+            self.watch_hit(addr, 'r')
+        if decoded[0] == OP_POP:
+            self.handle_pop(decoded)
+        elif addr >= MMIO_BASE:
+            self.handle_load_mmio(decoded)
+        else:
+            self.handle_load(decoded)
+
     def handle_store(self, decoded):
         _, mode, *rest = decoded
         match mode:
@@ -318,13 +1254,13 @@ class CPU:
         match mode:
             case 0b100:  # MODE_REG_IMM8
                 _, _, reg_d, imm8 = decoded
-                self.reg_set(reg_d, imm8)
                 self.update_ZN_from8(imm8)
+                self.reg_set(reg_d, imm8)
             case 0b011:  # MODE_REG_REG
                 _, _, reg_d, reg_s = decoded
                 v = self.reg_get(reg_s)
-                self.reg_set(reg_d, v)
                 self.update_ZN_from8(v)
+                self.reg_set(reg_d, v)
             case _:
                 raise RuntimeError("MOVE supports MODE_REG_IMM8 or MODE_REG_REG")
 
@@ -347,8 +1283,8 @@ class CPU:
             case 0b001:  # MODE_SINGLE_REG
                 _, _, reg_d = decoded
                 v = self.pop8()
-                self.reg_set(reg_d, v)
                 self.update_ZN_from8(v)
+                self.reg_set(reg_d, v)
             case _:
                 raise RuntimeError("POP expects MODE_SINGLE_REG")
 
@@ -365,11 +1301,10 @@ class CPU:
             case _:
                 raise RuntimeError("ADD supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        r, carry, v = self._add_core(a, b)
+        r = (a + b) & 0xFF
+        self._cv = (LAZY_ADD, a, b)
+        self._zn = r
         self.reg_set(reg_d, r)
-        self.set_flag(FLAG_C, carry)
-        self.set_flag(FLAG_V, v)
-        self.update_ZN_from8(r)
 
     def handle_addc(self, decoded):
         c = self.get_flag(FLAG_C)
@@ -385,11 +1320,10 @@ class CPU:
             case _:
                 raise RuntimeError("ADDC supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        r, carry, v = self._add_core(a, b)
+        r = (a + b) & 0xFF
+        self._cv = (LAZY_ADD, a, b)
+        self._zn = r
         self.reg_set(reg_d, r)
-        self.set_flag(FLAG_C, carry)
-        self.set_flag(FLAG_V, v)
-        self.update_ZN_from8(r)
 
     def handle_sub(self, decoded):
         _, mode, *rest = decoded
@@ -404,11 +1338,10 @@ class CPU:
             case _:
                 raise RuntimeError("SUB supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        r, borrow, v = self._sub_core(a, b)
+        r = (a - b) & 0xFF
+        self._cv = (LAZY_SUB, a, b)
+        self._zn = r
         self.reg_set(reg_d, r)
-        self.set_flag(FLAG_C, borrow)
-        self.set_flag(FLAG_V, v)
-        self.update_ZN_from8(r)
 
     def handle_subb(self, decoded):
         bi = self.get_flag(FLAG_C)
@@ -424,11 +1357,10 @@ class CPU:
             case _:
                 raise RuntimeError("SUBB supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        r, borrow, v = self._sub_core(a, b)
+        r = (a - b) & 0xFF
+        self._cv = (LAZY_SUB, a, b)
+        self._zn = r
         self.reg_set(reg_d, r)
-        self.set_flag(FLAG_C, borrow)
-        self.set_flag(FLAG_V, v)
-        self.update_ZN_from8(r)
 
     def handle_inc(self, decoded):
         _, mode, *rest = decoded
@@ -436,8 +1368,8 @@ class CPU:
             raise RuntimeError("INC expects MODE_SINGLE_REG")
         _, _, reg_d = decoded
         v = mask8(self.reg_get(reg_d) + 1)
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_dec(self, decoded):
         _, mode, *rest = decoded
@@ -445,8 +1377,8 @@ class CPU:
             raise RuntimeError("DEC expects MODE_SINGLE_REG")
         _, _, reg_d = decoded
         v = mask8(self.reg_get(reg_d) - 1)
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_shl(self, decoded):
         _, mode, *rest = decoded
@@ -462,8 +1394,8 @@ class CPU:
                 raise RuntimeError("SHL supports MODE_REG_IMM8 or MODE_REG_REG")
         
         v = mask8(self.reg_get(reg_d) << cnt)
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_shr(self, decoded):
         _, mode, *rest = decoded
@@ -479,8 +1411,8 @@ class CPU:
                 raise RuntimeError("SHR supports MODE_REG_IMM8 or MODE_REG_REG")
         
         v = (self.reg_get(reg_d) >> cnt) & 0xFF
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_and(self, decoded):
         _, mode, *rest = decoded
@@ -495,8 +1427,8 @@ class CPU:
             case _:
                 raise RuntimeError("AND supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_or(self, decoded):
         _, mode, *rest = decoded
@@ -511,8 +1443,8 @@ class CPU:
             case _:
                 raise RuntimeError("OR supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_nor(self, decoded):
         _, mode, *rest = decoded
@@ -527,8 +1459,8 @@ class CPU:
             case _:
                 raise RuntimeError("NOR supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_not(self, decoded):
         _, mode, *rest = decoded
@@ -536,8 +1468,8 @@ class CPU:
             raise RuntimeError("NOT expects MODE_SINGLE_REG")
         _, _, reg_d = decoded
         v = (~self.reg_get(reg_d)) & 0xFF
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_xor(self, decoded):
         _, mode, *rest = decoded
@@ -552,8 +1484,8 @@ class CPU:
             case _:
                 raise RuntimeError("XOR supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        self.reg_set(reg_d, v)
         self.update_ZN_from8(v)
+        self.reg_set(reg_d, v)
 
     def handle_inb(self, decoded):
         _, mode, *rest = decoded
@@ -568,24 +1500,36 @@ class CPU:
             case _:
                 raise RuntimeError("INB supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        val = self.ports[port & 0xFF]
-        self.reg_set(reg_d, val)
+        port &= 0xFF
+        if self.io_log is not None:
+            val = self.io_log.port_in(self, port)
+        elif self.port_devices[port] is not None:
+            val = self.port_devices[port].read(self, port) & 0xFF
+        else:
+            val = self.ports[port]
         self.update_ZN_from8(val)
+        self.reg_set(reg_d, val)
 
     def handle_outb(self, decoded):
         _, mode, *rest = decoded
         match mode:
             case 0b100:  # MODE_REG_IMM8
                 _, _, reg_d, imm8 = decoded
+                port = imm8
                 val = self.reg_get(reg_d)
-                self.ports[imm8 & 0xFF] = val
             case 0b011:  # MODE_REG_REG
                 _, _, reg_d, reg_s = decoded
                 port = self.reg_get(reg_d)
                 val = self.reg_get(reg_s)
-                self.ports[port & 0xFF] = val
             case _:
                 raise RuntimeError("OUTB supports MODE_REG_IMM8 or MODE_REG_REG")
+        port &= 0xFF
+        if self.io_log is not None:
+            self.io_log.port_out(self, port, val)
+        else:
+            self.ports[port] = val
+            if self.port_devices[port] is not None:
+                self.port_devices[port].write(self, port, val)
 
     def handle_cmp(self, decoded):
         _, mode, *rest = decoded
@@ -599,10 +1543,11 @@ class CPU:
             case _:
                 raise RuntimeError("CMP supports MODE_REG_IMM8 or MODE_REG_REG")
         
-        res = (a - b) & 0xFF
-        self.set_flag(FLAG_Z, res == 0)
-        self.set_flag(FLAG_N, (res & 0x80) != 0)
-        self.set_flag(FLAG_C, a < b)
+        # CMP leaves V alone, so a pending ADD/SUB overflow must be kept
+        if self._cv is not None and self._cv[0] != LAZY_CMP:
+            self.flush_flags()
+        self._cv = (LAZY_CMP, a, b)
+        self._zn = (a - b) & 0xFF
 
     def handle_jmp(self, decoded):
         _, mode, *rest = decoded
@@ -641,41 +1586,764 @@ class CPU:
         if mode != MODE_IMM8_ONLY:
             raise RuntimeError("INT expects MODE_IMM8_ONLY")
         _, _, imm8 = decoded
-        print(f"[INT {imm8}] (stub)")
-        self.STS |= 1
+        match imm8:
+            case 0xFE:  # WAIT: run this instruction again until an IRQ is taken
+                wait_pc = (self.PC - INT_SIZE) & 0xFFFF
+                if not self.STS & STS_IE:
+                    raise RuntimeError(f"INT 0x{INT_WAIT:02X} (WAIT) at 0x{wait_pc:04X} with interrupts disabled")
+                self.PC = wait_pc
+                self.waiting = True
+            case 0xFF:  # RETI
+                self.return_from_interrupt()
+            case _:
+                self.interrupt(imm8)
+
+    # ---------------- interrupts ----------------
+    def interrupt(self, n:int):
+        # push STS, F and PC, disable interrupts and jump through vector n
+        vector = self.read_u16(IVT_BASE + 2 * n)
+        if vector == 0:
+            raise RuntimeError(f"interrupt {n} has no vector (0x{IVT_BASE + 2 * n:04X} is zero)")
+        if self.verbose:
+            print(f"[INT {n}] -> 0x{vector:04X}")
+        ret = self.PC
+        if self.waiting:
+            # resume after the WAIT
+            ret = (ret + INT_SIZE) & 0xFFFF
+            self.waiting = False
+        self.push8(self.STS)
+        self.push8(self.flush_flags())
+        self.push8(ret >> 8)
+        self.push8(ret & 0xFF)
+        self.STS &= ~STS_IE
+        self.PC = vector
+        if self.timing:
+            self.cycles += INTERRUPT_CYCLES
+        # running blocks stop after handler fallbacks that bump the epoch
+        self.code_epoch += 1
+
+    def return_from_interrupt(self):
+        lo = self.pop8()
+        hi = self.pop8()
+        self._zn = self._cv = None
+        self.regs[REG_F] = self.pop8()
+        sts = self.pop8()
+        self.PC = (hi << 8) | lo
+        self.STS = (self.STS & ~STS_IE) | (sts & STS_IE)
+        if self.timing:
+            self.cycles += RETI_CYCLES
+        self.code_epoch += 1
+        if self.irq_pending:
+            self.check_interrupts()
+
+    def raise_irq(self, n:int):
+        # assert IRQ line n (0..0xFD). call it on the CPU thread, e.g. from a
+        # device's poll; the interrupt is taken right away if enabled, else
+        # it stays pending until STS gets STS_IE
+        self.irq_pending |= 1 << n
+        self.check_interrupts()
+
+    def check_interrupts(self):
+        # take the lowest pending IRQ if interrupts are enabled. this runs
+        # only when something changes (raise_irq, STS writes, RETI), so the
+        # execution loops never test for pending interrupts
+        pending = self.irq_pending
+        if not pending or self.halted or not self.STS & STS_IE:
+            return
+        n = (pending & -pending).bit_length() - 1
+        self.irq_pending = pending & ~(1 << n)
+        self.interrupt(n)
 
     def handle_halt(self, decoded):
         self.halted = True
         self.STS |= STS_HALT
-        print("HALT: CPU halted")
+        if self.verbose:
+            print("HALT: CPU halted")
 
     # ---------------- execute one ----------------
-    def step(self) -> Optional[str]:
+    def step(self, skip_break:bool=False) -> Optional[str]:
+        # skip_break: don't stop at a breakpoint on PC (to continue from it)
         if self.halted:
             return 'halted'
-        if self.PC in self.breakpoints:
-            return f"breakpoint 0x{self.PC:04X}"
+        pc = self.PC
+        if self.breakpoints and not skip_break:
+            bp = self.breakpoints.get(pc)
+            if bp is not None and bp.check(self):
+                return f"breakpoint 0x{pc:04X} (hit {bp.hits})"
+        entry = self.decode_cache.get(pc)
+        if entry is None:
+            entry = self.cache_decode(pc)
+        handler, decoded, self.PC = entry
+        if self.tracer is not None:
+            self.tracer.record(self, pc, decoded)
+        res = handler(decoded)
+        self.icount += 1
+        if self.timing:
+            self.cycles += CYCLE_TABLE[decoded[0]][decoded[1]]
+        if self.profiler is not None:
+            self.profiler.instruction(pc, decoded, entry[2], self.PC)
+        if self.watch_stop is not None:
+            res, self.watch_stop = self.watch_stop, None
+        return res
+
+    def execute_one(self) -> int:
+        # run the instruction at PC through its handler, without breakpoint,
+        # tracer or profiler hooks; returns the number retired
+        entry = self.decode_cache.get(self.PC)
+        if entry is None:
+            entry = self.cache_decode(self.PC)
+        handler, decoded, self.PC = entry
+        handler(decoded)
+        return 1
+
+    def advance(self):
+        # execute_one() with the icount and cycle bookkeeping of the run loops
+        entry = self.decode_cache.get(self.PC)
+        if entry is None:
+            entry = self.cache_decode(self.PC)
+        handler, decoded, self.PC = entry
+        handler(decoded)
+        self.icount += 1
+        if self.timing:
+            self.cycles += CYCLE_TABLE[decoded[0]][decoded[1]]
+
+    def run(self, max_instructions:Optional[int]=None, engine:str='step') -> str:
+        # run without breakpoint checks until HALT or the instruction budget
+        # is used up; returns 'halted' or 'budget'. Handler errors propagate.
+        end = None if max_instructions is None else self.icount + max_instructions
+        if self.devices:
+            return self._run_polled(end, engine)
+        return self._run(end, engine)
+
+    def _run_polled(self, end:Optional[int], engine:str) -> str:
+        # run() with devices attached: slices of poll_interval instructions
+        # with a device poll in between, so the loops themselves stay unchanged
+        while True:
+            stop = self.next_poll if end is None else min(end, self.next_poll)
+            status = self._run(stop, engine) if stop > self.icount else 'budget'
+            if self.icount >= self.next_poll:
+                self.poll_devices()
+                if self.idle_skip and not self.halted:
+                    self.skip_idle(end)
+            if self.halted or self.icount == end:
+                return 'halted' if self.halted else status
+
+    def _run(self, end:Optional[int], engine:str) -> str:
+        if self.tracer is not None:
+            return self._run_traced(end)
+        if self.profiler is not None:
+            return self._run_profiled(end)
+        if self.timing:
+            return self._run_timed(end, engine)
+        if engine == 'block':
+            blocks = self.block_cache
+            while not self.halted:
+                left = None if end is None else end - self.icount
+                if left == 0:
+                    return 'budget'
+                block = blocks.get(self.PC)
+                if block is None:
+                    block = self.translate_block(self.PC)
+                if left is not None and left < block[3]:
+                    self.step()
+                else:
+                    self.icount += block[0](self)
+            return 'halted'
+
+        cache = self.decode_cache
+        if end is None:
+            end = -1
+        while not self.halted:
+            count = self.icount
+            if count == end:
+                return 'budget'
+            pc = self.PC
+            entry = cache.get(pc)
+            if entry is None:
+                entry = self.cache_decode(pc)
+            handler, decoded, self.PC = entry
+            handler(decoded)
+            self.icount = count + 1
+        return 'halted'
+
+    def _run_timed(self, end:Optional[int], engine:str) -> str:
+        # _run() counting cycles: a table lookup per instruction, or one
+        # precomputed cost per translated block (see translate_block)
+        if engine == 'block':
+            blocks = self.block_cache
+            while not self.halted:
+                left = None if end is None else end - self.icount
+                if left == 0:
+                    return 'budget'
+                block = blocks.get(self.PC)
+                if block is None:
+                    block = self.translate_block(self.PC)
+                if left is not None and left < block[3]:
+                    self.step()
+                else:
+                    n = block[0](self)
+                    self.icount += n
+                    self.cycles += block[5][n]
+            return 'halted'
+
+        cache = self.decode_cache
+        table = CYCLE_TABLE
+        while not self.halted:
+            count = self.icount
+            if count == end:
+                return 'budget'
+            entry = cache.get(self.PC)
+            if entry is None:
+                entry = self.cache_decode(self.PC)
+            handler, decoded, self.PC = entry
+            handler(decoded)
+            self.icount = count + 1
+            self.cycles += table[decoded[0]][decoded[1]]
+        return 'halted'
+
+    def set_timing(self, enabled:bool):
+        # count cycles from now on (CYCLE_TABLE plus interrupt costs). off by
+        # default, so the untimed loops stay free of cycle bookkeeping.
+        # translated blocks differ when timing, so they are dropped
+        self.timing = enabled
+        self.block_cache.clear()
+
+    @property
+    def clock(self) -> int:
+        # what devices count time in: cycles while timing, else instructions
+        return self.cycles if self.timing else self.icount
+
+    # ---------------- devices ----------------
+    def attach(self, device):
+        # put a device on the port bus. it claims device.ports; INB/OUTB on
+        # them call device.read(cpu, port) / device.write(cpu, port, val), and
+        # device.poll(cpu) runs every poll_interval instructions
+        taken = [p for p in device.ports if self.port_devices[p] is not None]
+        if taken:
+            raise RuntimeError(f"port 0x{taken[0]:02X} is already claimed by {self.port_devices[taken[0]]!r}")
+        for p in device.ports:
+            self.port_devices[p] = device
+        self.devices.append(device)
+        device.attach(self)
+        self.next_poll = self.icount
+
+    def detach(self, device):
+        for p in device.ports:
+            self.port_devices[p] = None
+        self.devices.remove(device)
+        device.close()
+
+    def poll_devices(self):
+        for device in self.devices:
+            device.poll(self)
+        self.next_poll = self.icount + self.poll_interval
+
+    def service_devices(self):
+        # for loops that advance a step or block at a time (REPL cont/run)
+        if self.devices and self.icount >= self.next_poll:
+            self.poll_devices()
+
+    # ---------------- idle loops ----------------
+    def idle_loop(self, pc:int) -> Optional[list]:
+        # the straight-line instructions from pc to the next jump (or an
+        # INT WAIT) if they could form a loop that only reads memory and
+        # ports, else None
+        instrs = []
+        addr = pc
         saved = self.PC
-        decoded = self.decode()
-        opcode = decoded[0]
-        handler = self.handlers.get(opcode)
-        if handler is None:
-            raise RuntimeError(f"Unknown opcode 0x{opcode:02X} at 0x{saved:04X}")
-        return handler(decoded)
+        try:
+            while len(instrs) < BLOCK_MAX_INSTRUCTIONS:
+                entry = self.decode_cache.get(addr)
+                if entry is None:
+                    entry = self.cache_decode(addr)
+                decoded = entry[1]
+                opcode = decoded[0]
+                wait = opcode == OP_INT and decoded[1] == MODE_IMM8_ONLY and decoded[2] == INT_WAIT
+                if not (wait or opcode in IDLE_LOOP_OPS
+                        or (opcode == OP_LOAD and decoded[1] == MODE_REG_ABS16)):
+                    return None
+                instrs.append(decoded)
+                if wait or opcode in BLOCK_TERMINATORS:
+                    return instrs
+                addr = entry[2]
+        except RuntimeError:
+            return None
+        finally:
+            self.PC = saved
+        return None
+
+    def skip_idle(self, end:Optional[int]):
+        # called after a device poll. if the CPU is spinning in a loop whose
+        # registers, flags, SP and PC come out of one iteration unchanged,
+        # every further iteration is identical until a device changes what
+        # INB returns or raises an interrupt, which only happens at a poll.
+        # so the loop is skipped in whole iterations up to the next device
+        # event (or the next poll, for devices fed from outside), keeping
+        # icount exact
+        if self.tracer is not None or self.profiler is not None or self.io_log is not None:
+            return
+        # finish the block we were polled in, so PC is at a possible loop head
+        for _ in range(BLOCK_MAX_INSTRUCTIONS):
+            if self.halted or self.icount == end:
+                return
+            entry = self.decode_cache.get(self.PC)
+            if entry is None or entry[1][0] in BLOCK_TERMINATORS or entry[1][0] == OP_INT:
+                break
+            self.advance()
+        if self.halted or self.icount == end:
+            return
+        self.advance()
+        start = self.PC
+        body = self.idle_loop(start)
+        if body is None or (end is not None and self.icount + len(body) > end):
+            return
+        for decoded in body:
+            if decoded[0] == OP_INB:
+                port = decoded[3] if decoded[1] == MODE_REG_IMM8 else self.reg_get(decoded[3])
+                device = self.port_devices[port & 0xFF]
+                if device is not None and not device.idle(self, port & 0xFF):
+                    return
+        before = (bytes(self.regs), self.flush_flags(), self.SP)
+        for _ in body:
+            self.advance()
+            if self.halted:
+                return
+        if self.PC != start or (bytes(self.regs), self.flush_flags(), self.SP) != before:
+            return
+        n = len(body)
+        cost = sum(CYCLE_TABLE[decoded[0]][decoded[1]] for decoded in body)
+        events = [device.next_event(self) for device in self.devices]
+        if self.timing and None not in events:
+            # cycle times to instruction counts: no poll before the
+            # returned count can have reached the event
+            events = [self.icount + (e - self.cycles - 1) // cost * n + 1 for e in events]
+        # devices only change at polls, so skip to the first poll (on the
+        # regular schedule) at or after the next device event
+        target = self.next_poll
+        if None not in events and min(events) > target:
+            target += -(-(min(events) - target) // self.poll_interval) * self.poll_interval
+        if end is not None:
+            target = min(target, end)
+        skipped = (target - self.icount) // n * n
+        if skipped > 0:
+            self.icount += skipped
+            if self.timing:
+                self.cycles += skipped // n * cost
+            self.idle_skipped += skipped
+            # poll as soon as the skipped time is up
+            self.next_poll = target
+
+    def port_read(self, port:int) -> int:
+        device = self.port_devices[port]
+        return self.ports[port] if device is None else device.read(self, port) & 0xFF
+
+    def port_write(self, port:int, val:int):
+        self.ports[port] = val
+        device = self.port_devices[port]
+        if device is not None:
+            device.write(self, port, val)
+
+    # ---------------- breakpoints and watchpoints ----------------
+    def add_breakpoint(self, addr:int, condition:Optional[str]=None) -> Breakpoint:
+        bp = Breakpoint(addr, condition)
+        self.breakpoints[bp.addr] = bp
+        return bp
+
+    def add_watchpoint(self, start:int, end:Optional[int]=None, access:str='w') -> Watchpoint:
+        wp = Watchpoint(start, start if end is None else end, access)
+        self._set_watchpoints([*self.watchpoints, wp])
+        return wp
+
+    def clear_watchpoints(self):
+        self._set_watchpoints(())
+
+    def _set_watchpoints(self, watchpoints):
+        # writes are caught by WRITE_WATCH in write_map; reads by swapping
+        # the LOAD/POP handlers while read_watch is set, so cached code is
+        # decoded again when that changes
+        self._mark_watches(self.write_map, False)
+        self.watchpoints = watchpoints
+        self._mark_watches(self.write_map, True)
+        reads = [wp for wp in watchpoints if 'r' in wp.access]
+        read_watch = None
+        if reads:
+            read_watch = bytearray(MEM_SIZE)
+            for wp in reads:
+                read_watch[wp.start:wp.end + 1] = bytes([1]) * (wp.end + 1 - wp.start)
+        if read_watch is not None or self.read_watch is not None:
+            self.read_watch = read_watch
+            self.invalidate_code(0, MEM_SIZE)
+
+    def _mark_watches(self, wmap:bytearray, on:bool):
+        for wp in self.watchpoints:
+            if 'w' in wp.access:
+                for addr in range(wp.start, wp.end + 1):
+                    if on:
+                        wmap[addr] |= WRITE_WATCH
+                    else:
+                        wmap[addr] &= ~WRITE_WATCH
+
+    def watch_hit(self, addr:int, access:str):
+        # count the hit; step() stops after the instruction
+        for wp in self.watchpoints:
+            if access in wp.access and wp.start <= addr <= wp.end:
+                wp.hits += 1
+                if self.watch_stop is None:
+                    kind = 'read' if access == 'r' else 'write'
+                    self.watch_stop = f"watchpoint 0x{addr:04X} ({kind}, hit {wp.hits})"
+
+    # ---------------- snapshots ----------------
+    def snapshot(self) -> Snapshot:
+        self.flush_flags()
+        return Snapshot(bytes(self.ram), bytes(self.regs), self.PC, self.SP,
+                        bytes(self.ports), self.halted, self.icount, self.banks.contents())
+
+    def restore(self, snap:Snapshot, copy_on_write:bool=True):
+        # copy_on_write maps the snapshot's memory privately (cheap to fork,
+        # pages are copied on first write); otherwise memory is a plain copy
+        self.ram = snap.mapping() if copy_on_write else bytearray(snap.memory)
+        self.memory = self.ram
+        self._banked = None
+        self.banks.load(snap.banks)
+        self.regs[:] = snap.regs
+        self.PC = snap.PC
+        self.SP = snap.SP
+        self._zn = None
+        self._cv = None
+        self.ports = list(snap.ports)
+        self.halted = snap.halted
+        self.irq_pending = 0
+        self.waiting = False
+        self.icount = snap.icount
+        # nothing decoded from the old memory is valid any more
+        self.decode_cache.clear()
+        self.block_cache.clear()
+        self.write_map = self._base_write_map()
+        self.window_code = False
+        self.select_bank(snap.regs[REG_MB])
+
+    def _run_traced(self, end:Optional[int]) -> str:
+        # run() with a tracer attached: one instruction at a time on either engine
+        # the tracer's ring buffers are filled inline (see Tracer.record)
+        cache = self.decode_cache
+        tracer = self.tracer
+        t_icount, t_pc, t_decoded, t_flags = tracer.icount, tracer.pc, tracer.decoded, tracer.flags
+        size = tracer.size
+        flush = self.flush_flags
+        while not self.halted:
+            count = self.icount
+            if count == end:
+                return 'budget'
+            pc = self.PC
+            entry = cache.get(pc)
+            if entry is None:
+                entry = self.cache_decode(pc)
+            handler, decoded, self.PC = entry
+            i = tracer.pos
+            t_icount[i] = count
+            t_pc[i] = pc
+            t_decoded[i] = decoded
+            t_flags[i] = flush()
+            tracer.pos = 0 if i + 1 == size else i + 1
+            tracer.count += 1
+            handler(decoded)
+            self.icount = count + 1
+            if self.timing:
+                self.cycles += CYCLE_TABLE[decoded[0]][decoded[1]]
+            if self.profiler is not None:
+                self.profiler.instruction(pc, decoded, entry[2], self.PC)
+        return 'halted'
+
+    def _run_profiled(self, end:Optional[int]) -> str:
+        # run() with a profiler attached: always whole blocks, so the
+        # profiler pays one update per block rather than per instruction
+        blocks = self.block_cache
+        profiler = self.profiler
+        while not self.halted:
+            left = None if end is None else end - self.icount
+            if left == 0:
+                return 'budget'
+            block = blocks.get(self.PC)
+            if block is None:
+                block = self.translate_block(self.PC)
+            if left is not None and left < block[3]:
+                self.step()
+            else:
+                n = block[0](self)
+                self.icount += n
+                if self.timing:
+                    self.cycles += block[5][n]
+                profiler.block(block, n, self.PC)
+        return 'halted'
+
+    def register_values(self) -> dict:
+        values = {name: self.reg_get(code) for code, name in REG_CODE_TO_NAME.items()}
+        values['PC'] = self.PC
+        values['SP'] = self.SP
+        return values
+
+    # ---------------- block translation ----------------
+    def step_block(self) -> Optional[str]:
+        # run a whole translated basic block; single-step while debugging
+        if self.halted:
+            return 'halted'
+        if self.breakpoints or self.watchpoints or self.tracer is not None:
+            return self.step()
+        block = self.block_cache.get(self.PC)
+        if block is None:
+            block = self.translate_block(self.PC)
+        n = block[0](self)
+        self.icount += n
+        if self.timing:
+            self.cycles += block[5][n]
+        if self.profiler is not None:
+            self.profiler.block(block, n, self.PC)
+        return None
+
+    def invalidate_blocks(self, start:int, end:int):
+        stale = [pc for pc, (_, b_start, b_end, _, _, _) in self.block_cache.items()
+                 if any(start <= (b_start + i) & 0xFFFF < end
+                        for i in range((b_end - b_start) & 0xFFFF or MEM_SIZE))]
+        for pc in stale:
+            del self.block_cache[pc]
+
+    def translate_block(self, pc:int):
+        # decode a straight-line run of instructions ending at a jump or HALT
+        saved = self.PC
+        instrs = []
+        addr = pc
+        try:
+            while len(instrs) < BLOCK_MAX_INSTRUCTIONS:
+                entry = self.decode_cache.get(addr)
+                if entry is None:
+                    entry = self.cache_decode(addr)
+                instrs.append((addr, entry))
+                addr = entry[2]
+                if entry[1][0] in BLOCK_TERMINATORS:
+                    break
+        finally:
+            self.PC = saved
+
+        # backward pass: which flag bits each instruction must really compute
+        live = FLAGS_ALL
+        needed = []
+        for _, (handler, decoded, _) in reversed(instrs):
+            opcode = decoded[0]
+            exits = opcode in (OP_STORE, OP_PUSH) or (opcode == OP_LOAD and decoded[1] == MODE_REG_PAIR16)
+            if exits or self._emit(decoded, 0, 0, 0) is None:
+                # handler fallbacks and possible early exits observe every flag
+                needed.append(FLAG_WRITES.get(opcode, 0))
+                live = FLAGS_ALL
+                continue
+            writes = FLAG_WRITES.get(opcode, 0)
+            needed.append(writes & live)
+            live = (live & ~writes) | FLAG_READS.get(opcode, 0)
+        needed.reverse()
+
+        # inline POPs read M directly, so SP must stay below the register page.
+        # count them up to the next handler fallback (which may move SP) and
+        # check SP where each such stretch starts, while the flags are exact
+        bodies = [self._emit(decoded, next_pc, flags, i + 1)
+                  for i, ((_, (_, decoded, next_pc)), flags) in enumerate(zip(instrs, needed))]
+        pops = [0] * (len(instrs) + 1)
+        for i in reversed(range(len(instrs))):
+            if bodies[i] is not None:
+                pops[i] = pops[i + 1] + (instrs[i][1][1][0] == OP_POP)
+
+        # cycles[n]: cost of the first n instructions, added by the caller
+        cycles = [0]
+        for _, (_, decoded, _) in instrs:
+            cycles.append(cycles[-1] + CYCLE_TABLE[decoded[0]][decoded[1]])
+
+        ns = {}
+        lines = [
+            "def block(cpu):",
+            "    R = cpu.regs",
+            "    M = cpu.memory",
+            "    CM = cpu.write_map",
+            "    F = cpu.flush_flags()",
+            "    E = cpu.code_epoch",
+            "    I = cpu.icount",
+        ]
+        if pops[0]:
+            # too close to the top: run just the first instruction through its handler
+            lines += [f"    if cpu.SP > {MMIO_BASE - pops[0]}:", "        return cpu.execute_one()"]
+        for i, ((ipc, (handler, decoded, next_pc)), flags) in enumerate(zip(instrs, needed)):
+            lines.append(f"    # 0x{ipc:04X}")
+            body = bodies[i]
+            if body is None:
+                # no inline form: call the regular handler with synced state.
+                # icount is exact while it runs (I/O logs and errors see it)
+                # and put back afterwards because the caller adds our count
+                ns[f"h{i}"] = handler
+                ns[f"d{i}"] = decoded
+                call = [f"h{i}(d{i})"]
+                if self.timing and cycles[i]:
+                    # likewise the clock (interrupt costs the handler adds stay)
+                    call = [f"cpu.cycles += {cycles[i]}", *call, f"cpu.cycles -= {cycles[i]}"]
+                body = [f"cpu.PC = {next_pc}", "R[6] = F", f"cpu.icount = I + {i}", *call,
+                        "cpu.icount = I", "F = cpu.flush_flags()"]
+                if decoded[0] in BLOCK_TERMINATORS:
+                    body.append(f"return {i + 1}")
+                else:
+                    # the handler may have rewritten code later in this block
+                    body += ["if cpu.code_epoch != E:", f"    return {i + 1}"]
+                    if pops[i + 1]:
+                        body += [f"if cpu.SP > {MMIO_BASE - pops[i + 1]}:", f"    return {i + 1}"]
+            lines.extend("    " + line for line in body)
+        last_decoded, last_next = instrs[-1][1][1], instrs[-1][1][2]
+        if last_decoded[0] not in BLOCK_TERMINATORS:
+            lines += [f"    cpu.PC = {last_next}", "    R[6] = F", f"    return {len(instrs)}"]
+        src = "\n".join(lines) + "\n"
+        exec(compile(src, f"<block 0x{pc:04X}>", "exec"), ns)
+        block = (ns["block"], pc, addr, len(instrs),
+                 tuple((ipc, decoded, next_pc) for ipc, (_, decoded, next_pc) in instrs), tuple(cycles))
+        self.block_cache[pc] = block
+        return block
+
+    def _emit(self, decoded, next_pc:int, flags:int, count:int):
+        # python source for one instruction, or None to fall back to its handler
+        opcode, mode = decoded[0], decoded[1]
+
+        def reg(code):
+            # special registers go through the handlers
+            return f"R[{code}]" if code < REG_F else None
+
+        def zn(var):
+            out = []
+            if flags & (1 << FLAG_Z):
+                out.append(f"F = (F & 0xFD) | ((not {var}) << 1)")
+            if flags & (1 << FLAG_N):
+                out.append(f"F = (F & 0xFB) | (({var} & 0x80) >> 5)")
+            return out
+
+        def leave(target):
+            return [f"cpu.PC = {target}", "R[6] = F", f"return {count}"]
+
+        def store(addr, value):
+            # flagged bytes (code, register aliases, ROM) go through
+            # write_u8 with synced state, then the block ends so the change is seen
+            return [f"if CM[{addr}]:", f"    cpu.PC = {next_pc}", "    R[6] = F", f"    cpu.icount = I + {count - 1}",
+                    f"    cpu.write_u8({addr}, {value})", "    cpu.icount = I", f"    return {count}",
+                    f"M[{addr}] = {value}"]
+
+        operands = decoded[2:]
+        regs = []
+        if mode in (MODE_SINGLE_REG, MODE_REG_IMM8, MODE_REG_ABS16, MODE_REG_PAIR16):
+            regs.append(operands[0])
+        if mode == MODE_REG_REG:
+            regs += [operands[0], operands[1]]
+        if mode == MODE_REG_PAIR16:
+            regs += [operands[1] >> 4, operands[1] & 0x0F]
+        if any(reg(code) is None for code in regs):
+            return None
+
+        if mode == MODE_REG_REG:
+            d, src = reg(operands[0]), reg(operands[1])
+        elif mode == MODE_REG_IMM8:
+            d, src = reg(operands[0]), str(operands[1])
+        elif mode in (MODE_SINGLE_REG, MODE_REG_ABS16, MODE_REG_PAIR16):
+            d, src = reg(operands[0]), None
+        else:
+            d = src = None
+        if mode == MODE_REG_PAIR16:
+            pair = f"(({reg(operands[1] & 0x0F)} << 8) | {reg(operands[1] >> 4)})"
+
+        binary = mode in (MODE_REG_REG, MODE_REG_IMM8)
+        match opcode:
+            case 0 | 1 if mode == MODE_REG_ABS16:  # LOAD / STORE [imm16]
+                addr = operands[1]
+                if opcode == OP_LOAD:
+                    if addr >= MMIO_BASE or self.read_watch is not None:
+                        return None
+                    return [f"v = M[{addr}]", f"{d} = v", *zn("v")]
+                return store(addr, d)
+            case 0 | 1 if mode == MODE_REG_PAIR16:  # both write to [reg:reg]
+                return [f"a = {pair}", *store("a", d)]
+            case 2 if binary:  # MOVE
+                return [f"v = {src}", f"{d} = v", *zn("v")]
+            case 3 if mode == MODE_IMM8_ONLY or mode == MODE_SINGLE_REG:  # PUSH
+                value = operands[0] if mode == MODE_IMM8_ONLY else reg(operands[0])
+                return ["sp = (cpu.SP - 1) & 0xFFFF", "cpu.SP = sp", *store("sp", value)]
+            case 4 if mode == MODE_SINGLE_REG and self.read_watch is None:  # POP
+                # translate_block guards SP so this never reads the register page
+                return ["sp = cpu.SP", "v = M[sp]", "cpu.SP = (sp + 1) & 0xFFFF", f"{d} = v", *zn("v")]
+            case 5 | 6 | 7 | 8 if binary:  # ADD / ADDC / SUB / SUBB
+                b = src if opcode in (OP_ADD, OP_SUB) else f"{src} + (F & 1)"
+                out = [f"a = {d}", f"b = {b}"]
+                if opcode in (OP_ADD, OP_ADDC):
+                    out += ["s = a + b", "v = s & 0xFF"]
+                    carry, overflow = "s >> 8", "((~(a ^ b) & (a ^ v)) & 0x80) >> 4"
+                else:
+                    out += ["v = (a - b) & 0xFF"]
+                    carry, overflow = "(a < b)", "(((a ^ b) & (a ^ v)) & 0x80) >> 4"
+                out.append(f"{d} = v")
+                if flags & (1 << FLAG_C):
+                    out.append(f"F = (F & 0xFE) | {carry}")
+                if flags & (1 << FLAG_V):
+                    out.append(f"F = (F & 0xF7) | {overflow}")
+                return out + zn("v")
+            case 9 | 10 | 16 if mode == MODE_SINGLE_REG:  # INC / DEC / NOT
+                expr = {OP_INC: f"({d} + 1) & 0xFF", OP_DEC: f"({d} - 1) & 0xFF", OP_NOT: f"~{d} & 0xFF"}[opcode]
+                return [f"v = {expr}", f"{d} = v", *zn("v")]
+            case 11 | 12 | 13 | 14 | 15 | 17 if binary:  # SHL / SHR / AND / OR / NOR / XOR
+                if opcode in (OP_SHL, OP_SHR):
+                    cnt = operands[1] & 7 if mode == MODE_REG_IMM8 else f"({src} & 7)"
+                    expr = f"({d} << {cnt}) & 0xFF" if opcode == OP_SHL else f"{d} >> {cnt}"
+                else:
+                    expr = {OP_AND: f"{d} & {src}", OP_OR: f"{d} | {src}",
+                            OP_NOR: f"~({d} | {src}) & 0xFF", OP_XOR: f"{d} ^ {src}"}[opcode]
+                return [f"v = {expr}", f"{d} = v", *zn("v")]
+            case 20 if binary:  # CMP
+                out = [f"a = {d}", f"b = {src}", "v = (a - b) & 0xFF", *zn("v")]
+                if flags & (1 << FLAG_C):
+                    out.append("F = (F & 0xFE) | (a < b)")
+                return out
+            case 21:  # SEC
+                return ["F |= 1"]
+            case 22:  # CLC
+                return ["F &= 0xFE"]
+            case 23:  # CLZ
+                return ["F &= 0xFD"]
+            case 31:  # NOP
+                return []
+            case 24 | 25 | 26 | 27 | 28 if mode in (MODE_ABS16_ONLY, MODE_REG_PAIR16):
+                target = operands[0] if mode == MODE_ABS16_ONLY else pair
+                cond = {OP_JMP: None, OP_JZ: "F & 2", OP_JNZ: "not F & 2",
+                        OP_JC: "F & 1", OP_JNC: "not F & 1"}[opcode]
+                if cond is None:
+                    return leave(target)
+                return [f"cpu.PC = {target} if {cond} else {next_pc}", "R[6] = F", f"return {count}"]
+        return None
 
     # ---------------- disasm helper ----------------
-    def disasm_at(self, addr:int) -> str:
-        b0 = self.read_u8(addr)
-        opcode = (b0>>3) & 0b11111
-        mode = b0 & 0b111
-        return f"0x{addr:04X}: OP=0x{opcode:02X} MODE={mode}"
+    def disasm_at(self, addr:int, symbols:Optional[SymbolTable]=None) -> str:
+        # one line of JASM via disasm.py (shares the assembler's tables)
+        from disasm import instruction, label_map
+        _, text = instruction(self.memory, mask16(addr), label_map(symbols))
+        return f"0x{mask16(addr):04X}: {text}"
+
+    def disasm_lines(self, addr:int, count:int, symbols:Optional[SymbolTable]=None) -> list:
+        # count instructions from addr, linear sweep
+        from disasm import instruction, label_map
+        labels = label_map(symbols)
+        lines = []
+        for _ in range(count):
+            if addr in labels:
+                lines.append(f"{labels[addr]}:")
+            size, text = instruction(self.memory, addr, labels)
+            lines.append(f"0x{addr:04X}: {text}")
+            addr = (addr + size) & 0xFFFF
+        return lines
 
     # ---------------- REPL ----------------
     def repl(self):
         print("Type help for a list of commands.")
+        symbols = None
         while True:
             try:
-                cmd = input("(emu) ").strip().split()
+                line = input("(emu) ").strip()
+                cmd = line.split()
             except EOFError:
                 break
             except KeyboardInterrupt:
@@ -701,35 +2369,76 @@ class CPU:
                             print(res)
                     
                     case "cont":
-                        while True:
-                            res = self.step()
-                            if res:
-                                print(res)
-                                break
+                        advance = self.step_block if self.engine == 'block' else self.step
+                        # step off the breakpoint we may be stopped at
+                        res = self.step(skip_break=True)
+                        self.service_devices()
+                        while not res:
+                            res = advance()
+                            self.service_devices()
+                        print(res)
                     
                     case "run":
-                        while True:
-                            res = self.step()
-                            if res:
-                                print(res)
-                                break
+                        advance = self.step_block if self.engine == 'block' else self.step
+                        # step off the breakpoint we may be stopped at
+                        res = self.step(skip_break=True)
+                        self.service_devices()
+                        while not res:
+                            res = advance()
+                            self.service_devices()
+                        print(res)
                     
+                    case "engine":
+                        if len(cmd) > 1:
+                            if cmd[1] not in ('step', 'block'):
+                                print("usage: engine [step|block]")
+                                continue
+                            self.engine = cmd[1]
+                        print(f"engine: {self.engine}")
+
+                    case "cycles":
+                        if len(cmd) > 1:
+                            if cmd[1] not in ('on', 'off'):
+                                print("usage: cycles [on|off]")
+                                continue
+                            self.set_timing(cmd[1] == 'on')
+                        print(f"cycles: {self.cycles} ({'counting' if self.timing else 'off'})")
+
                     case "break":
-                        if len(cmd) < 2:
-                            print("usage: break <hex>")
+                        if len(cmd) < 2 or (len(cmd) > 2 and cmd[2] != "if") or len(cmd) == 3:
+                            print("usage: break <hex> [if <condition>]")
                             continue
-                        addr = int(cmd[1], 16)
-                        self.breakpoints.add(addr)
-                        print(f"breakpoint set @ 0x{addr:04X}")
+                        condition = line.split(None, 3)[3] if len(cmd) > 3 else None
+                        bp = self.add_breakpoint(int(cmd[1], 16), condition)
+                        print(f"breakpoint set @ 0x{bp.addr:04X}" + (f" if {condition}" if condition else ""))
 
                     case "bclear":
                         self.breakpoints.clear()
                         print("breakpoints cleared")
+
+                    case "watch":
+                        if len(cmd) < 2 or len(cmd) > 3:
+                            print("usage: watch <hex>[-<hex>] [r|w|rw]")
+                            continue
+                        first, _, last = cmd[1].partition("-")
+                        wp = self.add_watchpoint(int(first, 16), int(last, 16) if last else None,
+                                                 cmd[2] if len(cmd) > 2 else 'w')
+                        print(f"watchpoint set: {wp}")
+
+                    case "wclear":
+                        self.clear_watchpoints()
+                        print("watchpoints cleared")
+
+                    case "breaks":
+                        for bp in self.breakpoints.values():
+                            print(bp)
+                        for wp in self.watchpoints:
+                            print(wp)
                     
                     case "regs":
                         print(f"PC: 0x{self.PC:04X} SP: 0x{self.SP:04X} F: 0x{self.F:02X} STS: 0x{self.STS:02X}")
-                        for k in REG_INDEX:
-                            print(f"{k}: 0x{self.reg[k]:02X} ", end="")
+                        for i, k in enumerate(REG_INDEX):
+                            print(f"{k}: 0x{self.regs[i]:02X} ", end="")
                         print()
                     
                     case "mem":
@@ -749,17 +2458,76 @@ class CPU:
                             print()
                     
                     case "disasm":
+                        addr = int(cmd[1], 16) if len(cmd) > 1 else self.PC
+                        count = int(cmd[2]) if len(cmd) > 2 else 1
+                        for text in self.disasm_lines(addr, count, symbols):
+                            print(text)
+                    
+                    case "snapshot":
+                        if len(cmd) < 2:
+                            print("usage: snapshot <path>")
+                            continue
+                        self.snapshot().save(cmd[1])
+                        print(f"snapshot saved to {cmd[1]}")
+
+                    case "restore":
                         if len(cmd) < 2:
-                            print(self.disasm_at(self.PC))
+                            print("usage: restore <path>")
+                            continue
+                        self.restore(Snapshot.load(cmd[1]))
+                        print(f"restored {cmd[1]} (PC=0x{self.PC:04X}, {self.icount} instructions)")
+
+                    case "trace":
+                        if len(cmd) > 1 and cmd[1] == "on":
+                            size = int(cmd[2]) if len(cmd) > 2 else 8192
+                            self.tracer = Tracer(size)
+                            print(f"tracing the last {size} instructions")
+                        elif len(cmd) > 1 and cmd[1] == "off":
+                            self.tracer = None
+                            print("tracing off")
+                        elif self.tracer is None:
+                            print("tracing is off (trace on [size])")
                         else:
-                            addr = int(cmd[1], 16)
-                            print(self.disasm_at(addr))
-                    
+                            self.tracer.dump(last=int(cmd[1]) if len(cmd) > 1 else 20)
+
+                    case "profile":
+                        if len(cmd) > 1 and cmd[1] == "on":
+                            self.profiler = Profiler()
+                            print("profiling on")
+                        elif len(cmd) > 1 and cmd[1] == "off":
+                            self.profiler = None
+                            print("profiling off")
+                        elif self.profiler is None:
+                            print("profiling is off (profile on)")
+                        else:
+                            self.profiler.report(symbols=symbols, top=int(cmd[1]) if len(cmd) > 1 else 20)
+
+                    case "symbols":
+                        if len(cmd) < 2:
+                            print("usage: symbols <path>")
+                            continue
+                        symbols = SymbolTable.load(cmd[1])
+                        print(f"loaded {len(symbols.addrs)} symbols")
+
+                    case "record" | "replay":
+                        if len(cmd) < 2:
+                            print(f"usage: {c} <path>|stop")
+                            continue
+                        if self.io_log is not None:
+                            self.io_log.close()
+                            print(f"stopped after {self.io_log.records} I/O records")
+                            self.io_log = None
+                        if cmd[1] != "stop":
+                            self.io_log = IORecorder(cmd[1]) if c == "record" else IOReplayer(cmd[1])
+                            print(f"{c}ing port I/O {'to' if c == 'record' else 'from'} {cmd[1]}")
+
                     case "ports":
                         print("ports (nonzero):")
                         for i, v in enumerate(self.ports):
                             if v != 0:
                                 print(f" {i:02X}: {v:02X}")
+                        for device in self.devices:
+                            print(f"device {device!r}: ports {', '.join(f'{p:02X}' for p in device.ports)}")
                     
                     case "quit":
                         print("bye")
@@ -771,12 +2539,24 @@ class CPU:
                         print("step: Execute one instruction")
                         print("cont: Continue execution until a breakpoint or halt")
                         print("run: Run until halt")
-                        print("break <hex>: Set a breakpoint at address")
+                        print("engine [step|block]: Show or select the execution engine")
+                        print("cycles [on|off]: Show the cycle count, or start/stop counting cycles")
+                        print("break <hex> [if <cond>]: Set a breakpoint at address, e.g. break 0010 if A == 0x37")
                         print("bclear: Clear all breakpoints")
+                        print("watch <hex>[-<hex>] [r|w|rw]: Stop after reads and/or writes of an address range")
+                        print("wclear: Clear all watchpoints")
+                        print("breaks: List breakpoints and watchpoints with their hit counts")
                         print("regs: Display register values")
                         print("mem <hex> <len>: Display memory contents")
-                        print("disasm [addr]: Disassemble instruction at address (or PC)")
-                        print("ports: Display non-zero port values")
+                        print("disasm [addr] [n]: Disassemble n instructions (default 1) at address (or PC)")
+                        print("snapshot <path>: Save the machine state to a file")
+                        print("restore <path>: Restore the machine state from a snapshot file")
+                        print("trace on [size] | off | [n]: Trace into a ring buffer, or show its last n entries")
+                        print("profile on | off | [n]: Count executions, or show the top n of the report")
+                        print("symbols <path>: Load a jasm --symbols file to label profile addresses")
+                        print("record <path>|stop: Log every INB/OUTB to a file")
+                        print("replay <path>|stop: Feed INB from a log and check OUTB against it")
+                        print("ports: Display non-zero port values and attached devices")
                         print("quit: Exit the emulator")
                     
                     case _:
@@ -784,9 +2564,165 @@ class CPU:
             
             except Exception as e:
                 print("Error:", e)
+                if self.tracer is not None:
+                    self.tracer.dump(last=TRACE_DUMP_ON_ERROR)
+
+# ---------------- batch runner ----------------
+def run_batch(argv) -> int:
+    parser = argparse.ArgumentParser(prog="emulator.py run", description="Run a binary without the REPL and report JSON")
+    parser.add_argument("binary", nargs="?", help="The binary to run")
+    parser.add_argument("--max-instructions", type=int, default=None, help="Stop after this many instructions")
+    parser.add_argument("--engine", choices=("step", "block"), default="step", help="Execution engine")
+    parser.add_argument("--base", type=lambda x: int(x, 16), default=0x0000, help="Load address (hex)")
+    parser.add_argument("--banks", type=int, default=BANK_COUNT, metavar="N",
+                        help=f"Number of 16 KiB RAM banks selectable with MB (default {BANK_COUNT})")
+    parser.add_argument("--bank-file", default=None, metavar="PATH",
+                        help="Keep the banks in this memory-mapped file (created if missing)")
+    parser.add_argument("--protect-rom", action="store_true", help="Stop with an error on writes to 0x0000..0x7FFF")
+    parser.add_argument("--no-idle-skip", action="store_true",
+                        help="Run idle loops instruction by instruction instead of skipping to the next device event")
+    parser.add_argument("--cycles", action="store_true",
+                        help="Count cycles with the timing model (timers then tick in cycles)")
+    parser.add_argument("--device", action="append", default=[], metavar="KIND@PORT[:ARG][,irq=N]",
+                        help="Attach a device from devices.py (console@10, timer@20:PERIOD, disk@30:FILE)")
+    parser.add_argument("--restore", metavar="SNAPSHOT", default=None,
+                        help="Resume from a saved snapshot instead of loading a binary")
+    parser.add_argument("--save-snapshot", metavar="PATH", default=None, help="Save the final machine state")
+    io = parser.add_mutually_exclusive_group()
+    io.add_argument("--record", metavar="LOG", default=None, help="Log every INB/OUTB to LOG")
+    io.add_argument("--replay", metavar="LOG", default=None,
+                    help="Feed INB from LOG and check OUTB against it (stops at the first divergence)")
+    parser.add_argument("--trace", type=int, default=None, metavar="N",
+                        help="Keep the last N instructions in a ring buffer and dump it on HALT or error")
+    parser.add_argument("--trace-file", default=None, metavar="PATH", help="Write the trace dump here instead of stderr")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="Count executions and write a hot-spot report to PATH ('-' for stderr)")
+    parser.add_argument("--profile-collapsed", default=None, metavar="PATH",
+                        help="Also write the profile as flamegraph collapsed stacks")
+    parser.add_argument("--symbols", default=None, metavar="PATH", help="Symbol file from jasm --symbols for labels")
+    parser.add_argument("--cprofile", nargs="?", const="-", default=None, metavar="PATH",
+                        help="Run under cProfile: print the top functions to stderr, or save the stats to PATH")
+    parser.add_argument("--dump-regs", action="store_true", help="Include final register values")
+    parser.add_argument("--dump-mem", action="append", default=[], metavar="HEXADDR:LEN",
+                        help="Include LEN bytes of memory from HEXADDR (repeatable)")
+    args = parser.parse_args(argv)
+    if (args.binary is None) == (args.restore is None):
+        parser.error("give either a binary or --restore SNAPSHOT")
+
+    cpu = CPU(verbose=False)
+    cpu.banks = BankStore(args.banks, args.bank_file)
+    if args.restore:
+        cpu.restore(Snapshot.load(args.restore))
+    else:
+        with open(args.binary, "rb") as fh:
+            cpu.load_program(fh.read(), args.base)
+    if args.protect_rom:
+        cpu.set_rom_protection(True)
+    if args.no_idle_skip:
+        cpu.idle_skip = False
+    if args.cycles:
+        cpu.set_timing(True)
+    if args.device:
+        from devices import make_device
+        # console output goes to stderr, stdout is the JSON report
+        for spec in args.device:
+            cpu.attach(make_device(spec, sys.stderr.buffer))
+    if args.record:
+        cpu.io_log = IORecorder(args.record)
+    elif args.replay:
+        cpu.io_log = IOReplayer(args.replay)
+    if args.trace:
+        cpu.tracer = Tracer(args.trace)
+    if args.profile or args.profile_collapsed:
+        cpu.profiler = Profiler()
+
+    error = None
+    # a restored snapshot starts with instructions already retired
+    first = cpu.icount
+    host_profile = None
+    if args.cprofile:
+        import cProfile
+        host_profile = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        if host_profile is not None:
+            status = host_profile.runcall(cpu.run, args.max_instructions, args.engine)
+        else:
+            status = cpu.run(args.max_instructions, args.engine)
+    except Exception as e:
+        status, error = 'error', str(e)
+    finally:
+        if cpu.io_log is not None:
+            cpu.io_log.close()
+        for device in list(cpu.devices):
+            cpu.detach(device)
+    wall = time.perf_counter() - start
+
+    report = {
+        "binary": args.binary,
+        "snapshot": args.restore,
+        "status": status,
+        "instructions": cpu.icount,
+        # counted cycles with --cycles, otherwise the instruction count as before
+        "cycles": cpu.clock,
+        "wall_time": wall,
+        "ips": (cpu.icount - first) / wall if wall > 0 else None,
+        "pc": cpu.PC,
+        # peak resident set size of this process in KiB (Linux reports KiB, macOS bytes)
+        "max_rss_kb": None if resource is None else
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1),
+    }
+    if error is not None:
+        report["error"] = error
+    if args.device:
+        report["idle_skipped"] = cpu.idle_skipped
+    if cpu.io_log is not None:
+        report["io_records"] = cpu.io_log.records
+    if args.replay:
+        report["replay_complete"] = cpu.io_log.finished()
+    if args.dump_regs:
+        report["registers"] = cpu.register_values()
+    if args.dump_mem:
+        report["memory"] = {}
+        for spec in args.dump_mem:
+            addr, _, ln = spec.partition(":")
+            addr = int(addr, 16)
+            ln = int(ln) if ln else 1
+            report["memory"][f"{addr:04X}"] = bytes(cpu.memory[addr:addr+ln]).hex()
+    if cpu.tracer is not None and status in ('halted', 'error'):
+        if args.trace_file:
+            with open(args.trace_file, "w") as fh:
+                cpu.tracer.dump(fh)
+        else:
+            cpu.tracer.dump(sys.stderr)
+    if host_profile is not None:
+        if args.cprofile == "-":
+            import pstats
+            pstats.Stats(host_profile, stream=sys.stderr).sort_stats("tottime").print_stats(CPROFILE_TOP)
+        else:
+            host_profile.dump_stats(args.cprofile)
+    if cpu.profiler is not None:
+        symbols = SymbolTable.load(args.symbols) if args.symbols else None
+        if args.profile == "-":
+            cpu.profiler.report(sys.stderr, symbols)
+        elif args.profile:
+            with open(args.profile, "w") as fh:
+                cpu.profiler.report(fh, symbols)
+        if args.profile_collapsed:
+            with open(args.profile_collapsed, "w") as fh:
+                cpu.profiler.collapsed(fh, symbols)
+    if args.save_snapshot:
+        cpu.snapshot().save(args.save_snapshot)
+    cpu.banks.flush()
+    print(json.dumps(report))
+
+    # exit status: 0 halted, 1 error, 2 instruction budget exhausted
+    return {'halted': 0, 'error': 1, 'budget': 2}[status]
 
 # ---------------- main ----------------
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        sys.exit(run_batch(sys.argv[2:]))
     cpu = CPU()
     if len(sys.argv) > 1:
         path = sys.argv[1]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Fleet runner — execute many JOKOR binaries (or input variants of them) in parallel.
+Usage:
+    python fleet.py <dir|manifest.jsonl> [-j JOBS] [--max-instructions N] [--timeout SECONDS]
+                    [--engine step|block] [-o results.jsonl]
+
+A directory runs every *.bin file in it. A manifest is a JSONL file with one job per line:
+    {"id": "fib-7", "binary": "fib.bin", "ports": {"1": 7}, "memory": {"C000": "0a0b"},
+     "max_instructions": 100000, "timeout": 2.0}
+Each job needs either "binary" or "snapshot" (a file saved with `emulator.py run --save-snapshot`,
+used to skip a shared warm-up); relative paths are resolved against the manifest's directory.
+One JSON result per job is written in job order as soon as it (and every job before it) finishes.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+
+from emulator import CPU, Snapshot
+
+# instructions between wall-clock checks for the per-job timeout
+TIMEOUT_CHECK_INTERVAL = 50_000
+
+
+# ---------------- job loading ----------------
+def load_jobs(source:str) -> list:
+    if os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.endswith(".bin"))
+        return [{"id": n, "binary": os.path.join(source, n)} for n in names]
+
+    jobs = []
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as fh:
+        for lineno, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            if ("binary" in job) == ("snapshot" in job):
+                raise ValueError(f"{source}:{lineno}: job needs exactly one of 'binary' or 'snapshot'")
+            key = "binary" if "binary" in job else "snapshot"
+            job[key] = os.path.join(base, job[key])
+            job.setdefault("id", f"{lineno}:{os.path.basename(job[key])}")
+            jobs.append(job)
+    return jobs
+
+
+# ---------------- worker ----------------
+def run_job(args) -> dict:
+    job, defaults = args
+    max_instructions = job.get("max_instructions", defaults["max_instructions"])
+    timeout = job.get("timeout", defaults["timeout"])
+    engine = job.get("engine", defaults["engine"])
+
+    result = {"id": job["id"]}
+    result.update((key, job[key]) for key in ("binary", "snapshot") if key in job)
+    cpu = CPU(verbose=False)
+    start = time.perf_counter()
+    try:
+        if "snapshot" in job:
+            # copy-on-write restore: jobs forked from one snapshot share its pages
+            cpu.restore(Snapshot.load(job["snapshot"]))
+        else:
+            with open(job["binary"], "rb") as fh:
+                cpu.load_program(fh.read(), job.get("base", 0))
+        for port, value in job.get("ports", {}).items():
+            cpu.ports[int(port, 0) & 0xFF] = value & 0xFF
+        for addr, data in job.get("memory", {}).items():
+            addr = int(addr, 16)
+            for i, b in enumerate(bytes.fromhex(data)):
+                cpu.write_u8(addr + i, b)
+
+        # the budget counts from here (a snapshot may have retired some already)
+        end = None if max_instructions is None else cpu.icount + max_instructions
+        deadline = None if timeout is None else start + timeout
+        while True:
+            chunk = TIMEOUT_CHECK_INTERVAL if deadline is not None else None
+            if end is not None:
+                left = end - cpu.icount
+                chunk = left if chunk is None else min(chunk, left)
+            status = cpu.run(chunk, engine)
+            if status == 'halted':
+                break
+            if end is not None and cpu.icount >= end:
+                status = 'budget'
+                break
+            if time.perf_counter() >= deadline:
+                status = 'timeout'
+                break
+    except Exception as e:
+        status = 'error'
+        result["error"] = str(e)
+    wall = time.perf_counter() - start
+
+    result.update({
+        "status": status,
+        "instructions": cpu.icount,
+        "wall_time": wall,
+        "registers": cpu.register_values(),
+        "memory_sha256": hashlib.sha256(bytes(cpu.memory)).hexdigest(),
+    })
+    return result
+
+
+# ---------------- main ----------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run many JOKOR binaries in parallel")
+    parser.add_argument("source", help="Directory of .bin files or a JSONL manifest")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--max-instructions", type=int, default=None, help="Default per-job instruction budget")
+    parser.add_argument("--timeout", type=float, default=None, help="Default per-job wall-clock limit in seconds")
+    parser.add_argument("--engine", choices=("step", "block"), default="block", help="Execution engine")
+    parser.add_argument("-o", "--output", default=None, help="Write JSONL results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.source)
+    defaults = {"max_instructions": args.max_instructions, "timeout": args.timeout, "engine": args.engine}
+    work = [(job, defaults) for job in jobs]
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    failed = 0
+    try:
+        with multiprocessing.Pool(max(1, args.jobs)) as pool:
+            # imap keeps job order while still streaming finished results
+            for result in pool.imap(run_job, work, chunksize=1):
+                if result["status"] != 'halted':
+                    failed += 1
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"{len(jobs)} jobs, {failed} did not halt", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Symbol tables for naming addresses, shared by the emulator and the disassembler
+(which does not import emulator.py).
+"""
+import bisect
+from typing import Tuple, Optional
+
+MEM_SIZE = 65536
+
+
+class SymbolTable:
+    # label -> address map (the assembler's labels, or a jasm --symbols file)
+    # used to name addresses as label+offset
+    def __init__(self, labels:dict):
+        pairs = sorted((addr, name) for name, addr in labels.items())
+        self.addrs = [addr for addr, _ in pairs]
+        self.names = [name for _, name in pairs]
+
+    @classmethod
+    def load(cls, path:str) -> "SymbolTable":
+        labels = {}
+        with open(path) as fh:
+            for line in fh:
+                parts = line.split()
+                if len(parts) == 2 and not line.startswith("#"):
+                    labels[parts[1]] = int(parts[0], 16)
+        return cls(labels)
+
+    def lookup(self, addr:int) -> Optional[Tuple[str,int]]:
+        i = bisect.bisect_right(self.addrs, addr) - 1
+        if i < 0:
+            return None
+        return self.names[i], addr - self.addrs[i]
+
+    def format(self, addr:int) -> str:
+        found = self.lookup(addr)
+        if found is None:
+            return f"0x{addr:04X}"
+        name, offset = found
+        return f"{name}+0x{offset:X}" if offset else name
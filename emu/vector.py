@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Lockstep emulation of many JOKOR CPUs with NumPy (requires numpy).
+Usage:
+    python vector.py <binary> [-n LANES] [--max-steps N] [--vary-port PORT] [--vary-reg REG]
+                              [--compare K]
+
+Every lane has its own registers, flags, PC, SP, memory and ports, stored as arrays with a
+leading lane axis. Each step groups the running lanes by PC, decodes the instruction once per
+group and executes it for the whole group with array operations, so lanes that branch
+differently simply end up in different groups. Per lane the results match CPU.step.
+
+The command line runs one binary on LANES lanes (optionally giving each lane a different value
+in a port or register), reports aggregate instructions/sec and compares it with running the
+first K lanes as separate CPU objects.
+"""
+import sys
+import time
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("vector.py needs numpy (pip install numpy)")
+
+# opcodes are used as em.OP_* so that match cases compare values instead of binding names
+import emulator as em
+from emulator import (
+    CPU, MEM_SIZE, REG_CODE_TO_NAME, REG_F, REG_PC, REG_SP, REG_MB, REG_STS, STS_HALT, MMIO_BASE,
+    FLAG_C, FLAG_Z, FLAG_N, FLAG_V,
+    MODE_NO_OPERANDS, MODE_SINGLE_REG, MODE_IMM8_ONLY, MODE_REG_REG, MODE_REG_IMM8,
+    MODE_REG_ABS16, MODE_REG_PAIR16, MODE_ABS16_ONLY,
+)
+
+INSTRUCTION_SIZE = {
+    MODE_NO_OPERANDS: 1, MODE_SINGLE_REG: 2, MODE_IMM8_ONLY: 3, MODE_REG_REG: 2,
+    MODE_REG_IMM8: 3, MODE_REG_ABS16: 4, MODE_REG_PAIR16: 3, MODE_ABS16_ONLY: 4,
+}
+
+ZN_MASK = (1 << FLAG_Z) | (1 << FLAG_N)
+CV_MASK = (1 << FLAG_C) | (1 << FLAG_V)
+
+# opcode -> error for an unsupported addressing mode (see VectorCPU.error_message)
+UNSUPPORTED_MODE_MESSAGES = {}
+
+
+def decode_bytes(ins) -> tuple:
+    # same operand layout as CPU.decode, from the (up to) four instruction bytes
+    first = int(ins[0])
+    opcode, mode = (first >> 3) & 0b11111, first & 0b111
+    match mode:
+        case 0b000:
+            return (opcode, mode)
+        case 0b001:
+            return (opcode, mode, int(ins[1]) >> 4)
+        case 0b010:
+            return (opcode, mode, int(ins[2]))
+        case 0b011:
+            return (opcode, mode, int(ins[1]) >> 4, int(ins[1]) & 0x0F)
+        case 0b100:
+            return (opcode, mode, int(ins[1]) >> 4, int(ins[2]))
+        case 0b101:
+            return (opcode, mode, int(ins[1]) >> 4, int(ins[2]) | (int(ins[3]) << 8))
+        case 0b110:
+            return (opcode, mode, int(ins[1]) >> 4, int(ins[2]))
+        case _:
+            return (opcode, mode, int(ins[2]) | (int(ins[3]) << 8))
+
+
+class VectorCPU:
+    def __init__(self, lanes:int):
+        self.lanes = lanes
+        # register file per lane, indexed by register code like CPU.regs
+        self.regs = np.zeros((lanes, 16), dtype=np.uint8)
+        self.PC = np.zeros(lanes, dtype=np.int64)
+        self.SP = np.full(lanes, 0xFEFF, dtype=np.int64)
+        self.memory = np.zeros((lanes, MEM_SIZE), dtype=np.uint8)
+        self.ports = np.zeros((lanes, 256), dtype=np.uint8)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.icount = np.zeros(lanes, dtype=np.int64)
+        # lanes stopped by a handler error, with the message CPU.step would raise
+        self.errors = {}
+        self.failed = np.zeros(lanes, dtype=bool)
+        # addresses that still hold the same byte in every lane; instructions made
+        # only of such bytes are decoded once and cached by PC
+        self.shared = bytearray(b"\x01" * MEM_SIZE)
+        self.decode_cache = {}
+        self.active = None
+
+    def load_program(self, data:bytes, base:int=0x0000):
+        if base + len(data) > MEM_SIZE:
+            raise ValueError("Program too large")
+        self.memory[:, base:base+len(data)] = np.frombuffer(bytes(data), dtype=np.uint8)
+        self.shared[base:base+len(data)] = b"\x01" * len(data)
+        self.decode_cache.clear()
+        self.PC[:] = base
+
+    # ---------------- lane register access ----------------
+    def reg_get(self, lanes, code:int):
+        if code == REG_PC:
+            return self.PC[lanes] & 0xFF
+        if code == REG_SP:
+            return self.SP[lanes] & 0xFF
+        # Z and the unassigned codes never get written, so they read as zero
+        return self.regs[lanes, code].astype(np.int64)
+
+    def reg_set(self, lanes, code:int, values):
+        if code == REG_MB:
+            # lanes can't map different banks into one memory row
+            banked = np.broadcast_to(np.asarray(values) & 0xFF, lanes.shape) != 0
+            if banked.any():
+                self.fail(lanes[banked], "memory banking (MB != 0) is not supported by the vector engine")
+        if code < REG_F or code in (REG_F, 0xA, 0xB):
+            self.regs[lanes, code] = values & 0xFF
+        elif code == REG_SP:
+            self.SP[lanes] = (self.SP[lanes] & 0xFF00) | (values & 0xFF)
+        # PC is read-only, Z discards writes
+
+    def set_flags(self, lanes, mask:int, bits):
+        f = self.regs[lanes, REG_F].astype(np.int64)
+        self.regs[lanes, REG_F] = (f & ~mask) | bits
+
+    def zn_bits(self, r):
+        return ((r == 0).astype(np.int64) << FLAG_Z) | ((r >> 7) << FLAG_N)
+
+    def flag(self, lanes, bit:int):
+        return (self.regs[lanes, REG_F] >> bit) & 1
+
+    # ---------------- execution ----------------
+    def running(self):
+        if self.active is None:
+            self.active = np.flatnonzero(~(self.halted | self.failed))
+        return self.active
+
+    def wrote(self, addrs):
+        # lanes may now disagree about these bytes; call this after editing
+        # self.memory per lane by hand
+        sh = self.shared
+        for addr in np.unique(addrs).tolist() if isinstance(addrs, np.ndarray) else (addrs,):
+            if sh[addr]:
+                sh[addr] = 0
+                for pc in range(addr - 3, addr + 1):
+                    self.decode_cache.pop(pc & 0xFFFF, None)
+
+    def step(self) -> int:
+        # execute one instruction on every running lane; returns how many ran
+        lanes = self.running()
+        if lanes.size == 0:
+            return 0
+        pcs = self.PC[lanes]
+        pc0 = pcs[0]
+        if (pcs == pc0).all():
+            groups = ((int(pc0), lanes),)
+        else:
+            uniq, which = np.unique(pcs, return_inverse=True)
+            groups = [(int(pc), lanes[which == k]) for k, pc in enumerate(uniq)]
+        for pc, group in groups:
+            decoded = self.decode_cache.get(pc)
+            if decoded is not None:
+                self.execute(group, pc, decoded)
+                continue
+            addrs = (pc + np.arange(4)) & 0xFFFF
+            sh = self.shared
+            if all(sh[a] for a in addrs.tolist()):
+                decoded = self.decode_cache[pc] = decode_bytes(self.memory[group[0], addrs])
+                self.execute(group, pc, decoded)
+                continue
+            ins = self.memory[group[:, None], addrs]
+            if (ins == ins[0]).all():
+                self.execute(group, pc, decode_bytes(ins[0]))
+            else:
+                # lanes whose code differs (self-modifying code) decode separately
+                variants, which = np.unique(ins, axis=0, return_inverse=True)
+                for k, variant in enumerate(variants):
+                    self.execute(group[which.reshape(-1) == k], pc, decode_bytes(variant))
+        return lanes.size
+
+    def run(self, max_steps:int=None) -> int:
+        steps = 0
+        while max_steps is None or steps < max_steps:
+            if self.step() == 0:
+                break
+            steps += 1
+        return steps
+
+    def fail(self, lanes, message:str):
+        self.failed[lanes] = True
+        self.active = None
+        for lane in lanes:
+            self.errors[int(lane)] = message
+
+    def memory_addr(self, L, decoded):
+        # address each lane's LOAD/STORE/PUSH/POP touches, or None
+        opcode, mode = decoded[0], decoded[1]
+        if opcode in (em.OP_LOAD, em.OP_STORE) and mode == MODE_REG_ABS16:
+            return np.full(L.size, decoded[3], dtype=np.int64)
+        if opcode in (em.OP_LOAD, em.OP_STORE) and mode == MODE_REG_PAIR16:
+            pair = decoded[3]
+            return (self.reg_get(L, pair & 0x0F) << 8) | self.reg_get(L, pair >> 4)
+        if opcode == em.OP_PUSH:
+            return (self.SP[L].astype(np.int64) - 1) & 0xFFFF
+        if opcode == em.OP_POP:
+            return self.SP[L].astype(np.int64)
+        return None
+
+    def execute(self, L, pc:int, decoded):
+        addr = self.memory_addr(L, decoded)
+        if addr is not None:
+            # the register page aliases each lane's own registers
+            mapped = addr >= MMIO_BASE
+            if mapped.any():
+                self.fail(L[mapped], "memory-mapped registers are not supported by the vector engine")
+                L = L[~mapped]
+                if not L.size:
+                    return
+        mode = decoded[1]
+        nxt = (pc + INSTRUCTION_SIZE[mode]) & 0xFFFF
+        self.PC[L] = nxt
+        if self.execute_op(L, decoded, nxt) is False:
+            return
+        self.icount[L] += 1
+
+    def execute_op(self, L, decoded, nxt:int):
+        opcode, mode = decoded[0], decoded[1]
+        binary = mode in (MODE_REG_REG, MODE_REG_IMM8)
+        if binary:
+            d = decoded[2]
+            src = (lambda: np.full(L.size, decoded[3], dtype=np.int64)) if mode == MODE_REG_IMM8 \
+                else (lambda: self.reg_get(L, decoded[3]))
+
+        def pair_addr():
+            pair = decoded[3]
+            return (self.reg_get(L, pair & 0x0F) << 8) | self.reg_get(L, pair >> 4)
+
+        match opcode:
+            case em.OP_LOAD if mode == MODE_REG_ABS16:  # LOAD reg, [imm16]
+                v = self.memory[L, decoded[3]].astype(np.int64)
+                self.set_flags(L, ZN_MASK, self.zn_bits(v))
+                self.reg_set(L, decoded[2], v)
+            case em.OP_LOAD | em.OP_STORE if mode == MODE_REG_PAIR16:  # LOAD/STORE reg, [reg:reg] (both store)
+                addr = pair_addr()
+                self.memory[L, addr] = self.reg_get(L, decoded[2])
+                self.wrote(addr)
+            case em.OP_STORE if mode == MODE_REG_ABS16:  # STORE reg, [imm16]
+                self.memory[L, decoded[3]] = self.reg_get(L, decoded[2])
+                self.wrote(decoded[3])
+            case em.OP_MOVE if binary:  # MOVE
+                v = src()
+                self.set_flags(L, ZN_MASK, self.zn_bits(v))
+                self.reg_set(L, d, v)
+            case em.OP_PUSH if mode in (MODE_IMM8_ONLY, MODE_SINGLE_REG):  # PUSH
+                v = np.full(L.size, decoded[2]) if mode == MODE_IMM8_ONLY else self.reg_get(L, decoded[2])
+                sp = (self.SP[L] - 1) & 0xFFFF
+                self.SP[L] = sp
+                self.memory[L, sp] = v
+                self.wrote(sp)
+            case em.OP_POP if mode == MODE_SINGLE_REG:  # POP
+                sp = self.SP[L]
+                v = self.memory[L, sp].astype(np.int64)
+                self.SP[L] = (sp + 1) & 0xFFFF
+                self.set_flags(L, ZN_MASK, self.zn_bits(v))
+                self.reg_set(L, decoded[2], v)
+            case em.OP_ADD | em.OP_ADDC | em.OP_SUB | em.OP_SUBB if binary:  # ADD / ADDC / SUB / SUBB
+                a = self.reg_get(L, d)
+                b = src()
+                if opcode in (em.OP_ADDC, em.OP_SUBB):
+                    b = b + self.flag(L, FLAG_C)
+                if opcode in (em.OP_ADD, em.OP_ADDC):
+                    s = a + b
+                    r = s & 0xFF
+                    carry = (s > 0xFF).astype(np.int64)
+                    over = ((~(a ^ b) & (a ^ r) & 0x80) != 0).astype(np.int64)
+                else:
+                    r = (a - b) & 0xFF
+                    carry = (a < b).astype(np.int64)
+                    over = (((a ^ b) & (a ^ r) & 0x80) != 0).astype(np.int64)
+                bits = (carry << FLAG_C) | (over << FLAG_V) | self.zn_bits(r)
+                self.set_flags(L, CV_MASK | ZN_MASK, bits)
+                self.reg_set(L, d, r)
+            case em.OP_INC | em.OP_DEC | em.OP_NOT if mode == MODE_SINGLE_REG:  # INC / DEC / NOT
+                a = self.reg_get(L, decoded[2])
+                v = {em.OP_INC: a + 1, em.OP_DEC: a - 1, em.OP_NOT: ~a}[opcode] & 0xFF
+                self.set_flags(L, ZN_MASK, self.zn_bits(v))
+                self.reg_set(L, decoded[2], v)
+            case em.OP_SHL | em.OP_SHR | em.OP_AND | em.OP_OR | em.OP_NOR | em.OP_XOR if binary:  # SHL / SHR / AND / OR / NOR / XOR
+                b = src()
+                a = self.reg_get(L, d)
+                match opcode:
+                    case em.OP_SHL: v = (a << (b & 7)) & 0xFF
+                    case em.OP_SHR: v = a >> (b & 7)
+                    case em.OP_AND: v = a & b
+                    case em.OP_OR: v = a | b
+                    case em.OP_NOR: v = ~(a | b) & 0xFF
+                    case _: v = a ^ b
+                self.set_flags(L, ZN_MASK, self.zn_bits(v))
+                self.reg_set(L, d, v)
+            case em.OP_INB if binary:  # INB
+                port = src() & 0xFF
+                v = self.ports[L, port].astype(np.int64)
+                self.set_flags(L, ZN_MASK, self.zn_bits(v))
+                self.reg_set(L, d, v)
+            case em.OP_OUTB if binary:  # OUTB
+                if mode == MODE_REG_IMM8:
+                    self.ports[L, decoded[3] & 0xFF] = self.reg_get(L, d)
+                else:
+                    self.ports[L, self.reg_get(L, d) & 0xFF] = self.reg_get(L, decoded[3])
+            case em.OP_CMP if binary:  # CMP
+                a = self.reg_get(L, d)
+                b = src()
+                r = (a - b) & 0xFF
+                bits = ((a < b).astype(np.int64) << FLAG_C) | self.zn_bits(r)
+                self.set_flags(L, (1 << FLAG_C) | ZN_MASK, bits)
+            case em.OP_SEC | em.OP_CLC | em.OP_CLZ:  # SEC / CLC / CLZ
+                bit = FLAG_Z if opcode == em.OP_CLZ else FLAG_C
+                self.set_flags(L, 1 << bit, (1 << bit) if opcode == em.OP_SEC else 0)
+            case em.OP_JMP | em.OP_JZ | em.OP_JNZ | em.OP_JC | em.OP_JNC:  # JMP / JZ / JNZ / JC / JNC
+                cond = {
+                    em.OP_JMP: None,
+                    em.OP_JZ: lambda: self.flag(L, FLAG_Z) == 1,
+                    em.OP_JNZ: lambda: self.flag(L, FLAG_Z) == 0,
+                    em.OP_JC: lambda: self.flag(L, FLAG_C) == 1,
+                    em.OP_JNC: lambda: self.flag(L, FLAG_C) == 0,
+                }[opcode]
+                taken = L if cond is None else L[cond()]
+                if taken.size == 0:
+                    return True
+                if mode == MODE_ABS16_ONLY:
+                    self.PC[taken] = decoded[2]
+                elif mode == MODE_REG_PAIR16:
+                    pair = decoded[3]
+                    self.PC[taken] = (self.reg_get(taken, pair & 0x0F) << 8) | self.reg_get(taken, pair >> 4)
+                else:
+                    self.fail(taken, "JMP expects MODE_ABS16_ONLY or MODE_REG_PAIR16")
+                    # lanes that did not take the branch completed a NOP-like step
+                    if cond is not None:
+                        self.icount[L[~cond()]] += 1
+                    return False
+            case em.OP_INT if mode == MODE_IMM8_ONLY:  # INT
+                # interrupt frames and vectors are left to the scalar CPU
+                self.fail(L, "interrupts are not supported by the vector engine")
+                return False
+            case em.OP_HALT:  # HALT
+                self.halted[L] = True
+                self.active = None
+                self.regs[L, REG_STS] |= STS_HALT
+            case em.OP_NOP:  # NOP
+                pass
+            case _:
+                self.fail(L, self.error_message(opcode))
+                return False
+        return True
+
+    def error_message(self, opcode:int) -> str:
+        # the message the matching CPU handler raises for an unsupported mode,
+        # collected for all opcodes from one scratch CPU on first use
+        if not UNSUPPORTED_MODE_MESSAGES:
+            cpu = CPU(verbose=False)
+            for op, handler in cpu.handlers.items():
+                try:
+                    handler((op, -1, 0, 0))
+                except RuntimeError as e:
+                    UNSUPPORTED_MODE_MESSAGES[op] = str(e)
+        return UNSUPPORTED_MODE_MESSAGES.get(opcode, "unsupported addressing mode")
+
+    # ---------------- inspection ----------------
+    def lane_registers(self, lane:int) -> dict:
+        values = {name: int(self.reg_get(np.array([lane]), code)[0]) for code, name in REG_CODE_TO_NAME.items()}
+        values['PC'] = int(self.PC[lane])
+        values['SP'] = int(self.SP[lane])
+        return values
+
+
+# ---------------- benchmark ----------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Lockstep NumPy emulation of many CPUs")
+    parser.add_argument("binary", help="The binary to run on every lane")
+    parser.add_argument("-n", "--lanes", type=int, default=1000, help="Number of lanes")
+    parser.add_argument("--max-steps", type=int, default=None, help="Stop after this many lockstep steps")
+    parser.add_argument("--vary-port", type=lambda x: int(x, 0), default=None,
+                        help="Give lane i the value i & 0xFF on this port")
+    parser.add_argument("--vary-reg", choices=list(REG_CODE_TO_NAME.values())[:6], default=None,
+                        help="Give lane i the initial value i & 0xFF in this register")
+    parser.add_argument("--compare", type=int, default=50,
+                        help="Also run this many lanes as separate CPU objects and check they match")
+    args = parser.parse_args(argv)
+
+    with open(args.binary, "rb") as fh:
+        program = fh.read()
+    reg_code = {name: code for code, name in REG_CODE_TO_NAME.items()}.get(args.vary_reg)
+
+    vcpu = VectorCPU(args.lanes)
+    vcpu.load_program(program)
+    seeds = np.arange(args.lanes) & 0xFF
+    if args.vary_port is not None:
+        vcpu.ports[:, args.vary_port] = seeds
+    if reg_code is not None:
+        vcpu.regs[:, reg_code] = seeds
+
+    start = time.perf_counter()
+    steps = vcpu.run(args.max_steps)
+    wall = time.perf_counter() - start
+    total = int(vcpu.icount.sum())
+    print(f"vector: {args.lanes} lanes, {steps} steps, {total} instructions in {wall:.3f}s "
+          f"({total / wall:,.0f} instr/s)")
+
+    k = min(args.compare, args.lanes)
+    if k:
+        mismatches = 0
+        start = time.perf_counter()
+        scalar_total = 0
+        for lane in range(k):
+            cpu = CPU(verbose=False)
+            cpu.load_program(program)
+            if args.vary_port is not None:
+                cpu.ports[args.vary_port] = int(seeds[lane])
+            if reg_code is not None:
+                cpu.reg_set(reg_code, int(seeds[lane]))
+            error = None
+            try:
+                cpu.run(None if args.max_steps is None else int(vcpu.icount[lane]))
+            except RuntimeError as e:
+                error = str(e)
+            scalar_total += cpu.icount
+            if (cpu.register_values() != vcpu.lane_registers(lane)
+                    or bytes(cpu.memory) != vcpu.memory[lane].tobytes()
+                    or error != vcpu.errors.get(lane)):
+                mismatches += 1
+        scalar_wall = time.perf_counter() - start
+        print(f"scalar: {k} CPU objects, {scalar_total} instructions in {scalar_wall:.3f}s "
+              f"({scalar_total / scalar_wall:,.0f} instr/s), {mismatches} lanes differ")
+        return 1 if mismatches else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())